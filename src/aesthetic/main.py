@@ -1,66 +1,220 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import asyncio
 import base64
-import hashlib
+import hmac
 import logging
 import os
 import socket
+import struct
+import threading
+import time
 
-import jwt
 from volgactf.final.checker.result import Result
 
-from .utils import read_message, send_message
+from common.executors import EXECUTOR_THREAD, executor_for, run_in_executor
+from common.seeding import get_rng, random_bytes
+from .utils import read_message, read_message_digest, send_message
 
 logger = logging.getLogger(__name__)
 SERVICE_PORT = int(os.getenv('AESTHETIC_PORT', 8777))
 SESSION_TOTAL_TIMEOUT = int(os.getenv('AESTHETIC_TIMEOUT', 15))
+KEEP_ALIVE = os.getenv('AESTHETIC_KEEP_ALIVE', 'yes') == 'yes'
+KEEP_ALIVE_IDLE_TIMEOUT = int(os.getenv('AESTHETIC_KEEP_ALIVE_IDLE_TIMEOUT', 10))
+KEEP_ALIVE_MAX_FAILURES = 2
+
+# N.B. resource profile of the operations, read by the simulator (see simulator/registry.py): the protocol is
+#      spoken over blocking sockets, so the operations are run on the thread pool (one idle connection per
+#      endpoint is kept, see ConnectionPool)
+PROFILE = {
+    'push': {'cpu_heavy': False, 'io_bound': True, 'max_concurrency': 4, 'executor': EXECUTOR_THREAD},
+    'pull': {'cpu_heavy': False, 'io_bound': True, 'max_concurrency': 4, 'executor': EXECUTOR_THREAD},
+}
+
+LABEL_VERSION = 2
+LABEL_HEADER = struct.Struct('>BBB')  # version, IV length, auth tag length; followed by IV, auth tag and hash
+LABEL_HASH_LENGTH = 32
+
+
+def pack_label(iv, auth_tag, ec_hash):
+    data = LABEL_HEADER.pack(LABEL_VERSION, len(iv), len(auth_tag)) + iv + auth_tag + ec_hash
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def unpack_label(label):
+    # N.B. labels of the flags pushed before the compact format was introduced are `iv::auth_tag::hash`
+    if '::' in label:
+        return tuple(base64.b64decode(v) for v in label.encode().split(b'::'))
+
+    data = base64.urlsafe_b64decode(label.encode())
+    version, iv_length, auth_tag_length = LABEL_HEADER.unpack_from(data)
+    if version != LABEL_VERSION or len(data) != LABEL_HEADER.size + iv_length + auth_tag_length + LABEL_HASH_LENGTH:
+        raise ValueError('Incorrect label: version={0}, length={1}'.format(version, len(data)))
+    offset = LABEL_HEADER.size + iv_length
+    return data[LABEL_HEADER.size:offset], data[offset:offset + auth_tag_length], data[offset + auth_tag_length:]
+
+
+class ConnectionPool(object):
+    # Keeps one idle connection per endpoint, so the round's PUSH and PULLs run over a single session
+    #   instead of doing EXIT after every operation. If reused connections keep failing, the endpoint is
+    #   considered not to support several commands per connection and reuse is switched off for it.
+    def __init__(self, keep_alive=KEEP_ALIVE, idle_timeout=KEEP_ALIVE_IDLE_TIMEOUT):
+        self.keep_alive = keep_alive
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, endpoint, reuse=True):
+        with self._lock:
+            fd, last_used = self._idle.pop(endpoint, (None, 0)) if reuse else (None, 0)
+        if fd is not None:
+            if time.monotonic() - last_used < self.idle_timeout:
+                return fd, True
+            self.exit(fd)
+        return socket.create_connection((endpoint, SERVICE_PORT), timeout=SESSION_TOTAL_TIMEOUT), False
+
+    def release(self, endpoint, fd, reused):
+        with self._lock:
+            if reused:
+                self._failures.pop(endpoint, None)
+            if self.keep_alive and self._failures.get(endpoint, 0) < KEEP_ALIVE_MAX_FAILURES:
+                fd, self._idle[endpoint] = self._idle.get(endpoint, (None, 0))[0], (fd, time.monotonic())
+        if fd is not None:
+            self.exit(fd)
+
+    def discard(self, endpoint, fd, reused, graceful=False):
+        if reused:
+            with self._lock:
+                self._failures[endpoint] = self._failures.get(endpoint, 0) + 1
+        if graceful:
+            self.exit(fd)
+        else:
+            fd.close()
 
+    @staticmethod
+    def exit(fd):
+        try:
+            send_message(fd, b'EXIT')
+            read_message(fd)
+        except Exception:
+            pass
+        finally:
+            fd.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for fd, _ in idle.values():
+            self.exit(fd)
+
+
+connections = ConnectionPool()
+
+
+async def run_operation(endpoint, stage, operation, *args):
+    # N.B. an operation failed on a reused connection is retried once on a new connection: the service might
+    #      have closed it meanwhile or not support several commands per connection at all (then the reply to
+    #      the next command is garbage), so only the result of a new connection is trusted to be not UP.
+    #      A PUSH can't be retried (the flag may have been stored already), so it always starts a new connection
+    executor = executor_for(__name__, stage.lower(), PROFILE[stage.lower()]['executor'])
+    for attempt in range(2):
+        try:
+            logger.debug('[%s on %s]: connecting', endpoint, stage)
+            fd, reused = await run_in_executor(executor, connections.acquire, endpoint, stage != 'PUSH')
+            logger.debug('[%s on %s]: connected to service (reused=%s)', endpoint, stage, reused)
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            logger.error('[%s on %s]: failed to connect, reason: %s', endpoint, stage, str(ex))
+            return None
+
+        try:
+            result = await run_in_executor(executor, operation, fd, *args)
+        except asyncio.CancelledError:
+            # N.B. closing the socket unblocks the operation still running on the thread pool
+            fd.close()
+            raise
+        except Exception as ex:
+            connections.discard(endpoint, fd, reused)  # N.B. doesn't block: the socket is closed as is
+            if reused and attempt == 0:
+                logger.info('[%s on %s]: reused connection failed (%s), retrying on a new one', endpoint, stage, ex)
+                continue
+            raise
+        if result[0] != Result.UP:
+            # N.B. the protocol state of the connection is unknown after a failed operation, it's ended with EXIT
+            await run_in_executor(executor, connections.discard, endpoint, fd, reused, True)
+            if reused and attempt == 0:
+                logger.info('[%s on %s]: reused connection returned %s, retrying on a new one', endpoint, stage,
+                            result[0])
+                continue
+            return result
+        # N.B. releasing may EXIT the connection it replaces
+        await run_in_executor(executor, connections.release, endpoint, fd, reused)
+        return result
+
+
+def push_operation(fd, capsule, metadata):
+    send_message(fd, b'PUSH')
+
+    iv = b'\x70\x67\x4a\xd5\xaf\x53\x92\xf9\xb2\x94\xde\x78' + random_bytes(get_rng(metadata), 4)
+
+    send_message(fd, capsule.encode('utf-8'))
+    send_message(fd, metadata.round.to_bytes(4, 'big'))
+    send_message(fd, iv)
+
+    ec_hash = read_message_digest(fd)
+    auth_tag = read_message(fd)
+
+    import jwt
+    with open('ec_private.pem', 'rb') as jwtkey:
+        key = jwtkey.read()
+    signature = jwt.encode(
+        {'message': 'It\'s me, Mario!'},
+        key=key,
+        algorithm='ES256'
+    )
+
+    send_message(fd, signature.encode('utf-8'))
+
+    if read_message(fd) != b"+":
+        return Result.MUMBLE, '', ''
 
-async def push(endpoint, capsule: str, label, metadata):
-    try:
-        logger.debug('[%s on PUSH]: connecting', endpoint)
-        fd = socket.create_connection((endpoint, SERVICE_PORT), timeout=SESSION_TOTAL_TIMEOUT)
-        logger.debug('[%s on PUSH]: connected to service', endpoint)
-    except Exception as ex:
-        logger.error('[%s on PUSH]: failed to connect, reason: %s', endpoint, str(ex))
-        return Result.DOWN, '', 'Failed to connect'
+    return Result.UP, pack_label(iv, auth_tag, ec_hash), 'UP'
 
-    try:
-        send_message(fd, b'PUSH')
 
-        iv = b'\x70\x67\x4a\xd5\xaf\x53\x92\xf9\xb2\x94\xde\x78' + os.urandom(4)
+def pull_operation(fd, capsule, label, metadata):
+    iv, auth_tag, ec_hash = unpack_label(label)
 
-        send_message(fd, capsule.encode('utf-8'))
-        send_message(fd, metadata.round.to_bytes(4, 'big'))
-        send_message(fd, iv)
+    send_message(fd, b'PULL')
+    send_message(fd, metadata.round.to_bytes(4, 'big'))
 
-        encrypted_capsule = read_message(fd)
-        ec_hash = hashlib.sha256(encrypted_capsule).digest()
-        auth_tag = read_message(fd)
+    rec_hash = read_message_digest(fd)
 
-        with open('ec_private.pem', 'rb') as jwtkey:
-            key = jwtkey.read()
-        signature = jwt.encode(
-            {'message': 'It\'s me, Mario!'},
-            key=key,
-            algorithm='ES256'
-        )
+    if not hmac.compare_digest(rec_hash, ec_hash):
+        logger.debug('Wrong hash: received %s, expected %s', rec_hash.hex(), ec_hash.hex())
+        send_message(fd, b'-')
+        return Result.DOWN, 'Wrong hash'
+    else:
+        send_message(fd, b'+')
 
-        send_message(fd, signature.encode('utf-8'))
+    send_message(fd, iv)
+    send_message(fd, auth_tag)
 
-        if read_message(fd) != b"+":
-            send_message(fd, b'EXIT')
-            read_message(fd)
-            return Result.MUMBLE, '', ''
+    recv_capsule = read_message(fd)
+
+    if recv_capsule.decode('utf-8') != capsule:
+        return Result.DOWN, 'Corrupted flag'
+
+    return Result.UP, 'UP'
 
-        send_message(fd, b'EXIT')
-        read_message(fd)
 
-        return Result.UP, \
-               (base64.b64encode(iv) + b'::' +
-                base64.b64encode(auth_tag) + b'::' +
-                base64.b64encode(ec_hash)).decode(), \
-               'UP'
+async def push(endpoint, capsule: str, label, metadata):
+    try:
+        result = await run_operation(endpoint, 'PUSH', push_operation, capsule, metadata)
+        if result is None:
+            return Result.DOWN, '', 'Failed to connect'
+        return result
 
     except Exception as ex:
         logger.error('[%s on PUSH]: failed on PUSH, reason: %s', endpoint, str(ex))
@@ -69,49 +223,15 @@ async def push(endpoint, capsule: str, label, metadata):
 
 async def pull(endpoint, capsule: bytes, label: str, metadata):
     try:
-        logger.debug('[%s on PULL]: connecting', endpoint)
-        fd = socket.create_connection((endpoint, SERVICE_PORT), timeout=SESSION_TOTAL_TIMEOUT)
-        logger.debug('[%s on PULL]: connected to service', endpoint)
-    except Exception as ex:
-        logger.error('[%s on PULL]: failed to connect, reason: %s', endpoint, str(ex))
-        return Result.DOWN, ''
-
-    try:
-        b64_iv, b64_auth_tag, b64_ec_hash = label.encode().split(b'::')
-        iv = base64.b64decode(b64_iv)
-        auth_tag = base64.b64decode(b64_auth_tag)
-        ec_hash = base64.b64decode(b64_ec_hash)
-
-        send_message(fd, b'PULL')
-        send_message(fd, metadata.round.to_bytes(4, 'big'))
-
-        received_enc_capsule = read_message(fd)
-        rec_hash = hashlib.sha256(received_enc_capsule).digest()
-
-        if rec_hash != ec_hash:
-            print(rec_hash, ec_hash)
-            send_message(fd, b'-')
-            send_message(fd, b'EXIT')
-            read_message(fd)
-            return Result.DOWN, 'Wrong hash'
-        else:
-            send_message(fd, b'+')
-
-        send_message(fd, iv)
-        send_message(fd, auth_tag)
-
-        recv_capsule = read_message(fd)
-
-        if recv_capsule.decode('utf-8') != capsule:
-            send_message(fd, b'EXIT')
-            read_message(fd)
-            return Result.DOWN, 'Corrupted flag'
-
-        send_message(fd, b'EXIT')
-        read_message(fd)
-
-        return Result.UP, 'UP'
+        result = await run_operation(endpoint, 'PULL', pull_operation, capsule, label, metadata)
+        if result is None:
+            return Result.DOWN, ''
+        return result
 
     except Exception as ex:
         logger.error('[%s on PULL]: failed on PULL, reason: %s', endpoint, str(ex))
         return Result.MUMBLE, ''
+
+
+async def shutdown():
+    await run_in_executor(executor_for(__name__, 'pull', PROFILE['pull']['executor']), connections.close)
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import logging
 import struct
+import time
+
+from common.trace import recorder, record_frame
 
 
 logger = logging.getLogger('service')
@@ -18,26 +22,47 @@ class InputUnderflowException(Exception):
     pass
 
 
-def read_message(s, max_input_length=1024*16) -> bytes:
+def iter_message(s, max_input_length=1024*16):
+    started = time.time() if recorder.enabled else None
     received_buffer = s.recv(8)
     if len(received_buffer) < 8:
         raise InputUnderflowException('Failed to receive data: the received length is less than 8 bytes long')
     to_receive = struct.unpack('<Q', received_buffer[0:8])[0]
     if to_receive > max_input_length:
         raise InputOverflowException('Failed to receive data: requested to accept too much data')
-    received_buffer = b''
+    received = 0
 
-    while len(received_buffer) < to_receive:
-        data = s.recv(to_receive - len(received_buffer))
+    while received < to_receive:
+        data = s.recv(to_receive - received)
         if len(data) == 0:
             raise InputUnderflowException('Failed to receive data: the pipe must have been broken')
-        received_buffer += data
-        if len(received_buffer) > max_input_length:
+        received += len(data)
+        if received > max_input_length:
             raise InputOverflowException('Failed to receive data: accepted too much data')
+        yield data
+
+    if started is not None:
+        record_frame('aesthetic', s, 'RECV', to_receive, started)
+
+
+def read_message(s, max_input_length=1024*16) -> bytes:
+    received_buffer = bytearray()
+    for data in iter_message(s, max_input_length):
+        received_buffer += data
+    return bytes(received_buffer)
+
 
-    return received_buffer
+def read_message_digest(s, algorithm='sha256', max_input_length=1024*16) -> bytes:
+    # N.B. the message is hashed while it's being received and is never buffered
+    h = hashlib.new(algorithm)
+    for data in iter_message(s, max_input_length):
+        h.update(data)
+    return h.digest()
 
 
 def send_message(s, message: bytes):
+    started = time.time() if recorder.enabled else None
     send_buffer = struct.pack('<Q', len(message)) + message
     s.sendall(send_buffer)
+    if started is not None:
+        record_frame('aesthetic', s, 'SEND', len(message), started, message)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Aesthetic label benchmark: parse + verify of the legacy `iv::tag::hash` and the compact labels.
+#
+# Usage (from the `src` folder):
+#   $ python -m benchmarks.aesthetic_label [n_ops]
+#
+# Verification hashes an encrypted capsule close to the 16 KiB frame cap: once as a whole (legacy) and
+#   frame by frame as it's received (`read_message_digest`) over a local socket pair.
+import base64
+import hashlib
+import hmac
+import os
+import socket
+import sys
+import time
+
+from aesthetic.main import pack_label, unpack_label
+from aesthetic.utils import read_message, read_message_digest, send_message
+
+CAPSULE_SIZE = 16 * 1024 - 64
+
+
+def legacy_parse(label):
+    b64_iv, b64_auth_tag, b64_ec_hash = label.encode().split(b'::')
+    return base64.b64decode(b64_iv), base64.b64decode(b64_auth_tag), base64.b64decode(b64_ec_hash)
+
+
+def bench(name, n_ops, fn):
+    started = time.perf_counter()
+    for _ in range(n_ops):
+        fn()
+    elapsed = time.perf_counter() - started
+    print('{0:<36} {1:>12,.0f} ops/sec'.format(name, n_ops / elapsed))
+
+
+def main(n_ops):
+    iv, auth_tag, capsule = os.urandom(16), os.urandom(16), os.urandom(CAPSULE_SIZE)
+    ec_hash = hashlib.sha256(capsule).digest()
+    legacy_label = (base64.b64encode(iv) + b'::' + base64.b64encode(auth_tag) + b'::' +
+                    base64.b64encode(ec_hash)).decode()
+    label = pack_label(iv, auth_tag, ec_hash)
+    print('label length: legacy={0}, compact={1}'.format(len(legacy_label), len(label)))
+
+    bench('parse (legacy)', n_ops, lambda: legacy_parse(legacy_label))
+    bench('parse (compact)', n_ops, lambda: unpack_label(label))
+
+    left, right = socket.socketpair()
+    try:
+        def verify_legacy():
+            send_message(left, capsule)
+            _, _, h = legacy_parse(legacy_label)
+            assert hashlib.sha256(read_message(right)).digest() == h
+
+        def verify_compact():
+            send_message(left, capsule)
+            _, _, h = unpack_label(label)
+            assert hmac.compare_digest(read_message_digest(right), h)
+
+        bench('parse + receive + verify (legacy)', n_ops, verify_legacy)
+        bench('parse + receive + verify (compact)', n_ops, verify_compact)
+    finally:
+        left.close()
+        right.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
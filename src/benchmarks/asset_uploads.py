@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Editor asset upload benchmark: the multipart body of a bundled asset built and serialized per request,
+#   as `FormData` around a fresh `BytesIO` copy (read from the disk) vs the cached file part.
+#
+# Usage (from the `src` folder):
+#   $ python -m benchmarks.asset_uploads [n_uploads] [assets_folder_path]
+import asyncio
+import io
+import random
+import sys
+import time
+
+import aiohttp
+
+from common.multipart import MultipartCache
+from editor.utils import asset_cache
+
+
+class NullWriter(object):
+    def __init__(self):
+        self.size = 0
+
+    async def write(self, chunk):
+        self.size += len(chunk)
+
+
+def form_data_body(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    form = aiohttp.FormData()
+    form.add_field('image', io.BytesIO(data), filename='image.png', content_type='image/png')
+    form.add_field('name', 'a1b2c3d4e5f6')
+    form.add_field('about', 'Lorem ipsum dolor sit amet')
+    return form()
+
+
+def cached_body(cache, path):
+    asset = asset_cache.load(path)
+    return cache.body(asset.digest, asset.read(), 'image', 'image.png', 'image/png',
+                      [('name', 'a1b2c3d4e5f6'), ('about', 'Lorem ipsum dolor sit amet')])
+
+
+async def bench(name, paths, build):
+    writer = NullWriter()
+    started = time.perf_counter()
+    for path in paths:
+        await build(path).write(writer)
+    elapsed = time.perf_counter() - started
+    print('{0:<28} {1:>8.1f} uploads/sec {2:>8.1f} MiB/sec'.format(
+        name, len(paths) / elapsed, writer.size / elapsed / 2 ** 20))
+
+
+def main(n_uploads, assets_folder_path):
+    paths = [random.choice(asset_cache.listing(assets_folder_path, fmt)) for fmt in ('png', 'jpg')
+             for _ in range(n_uploads // 2)]
+    cache = MultipartCache()
+    for path in set(paths):
+        cached_body(cache, path)  # warm up: the first use of an asset is the same in both cases
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(bench('FormData + BytesIO', paths, form_data_body))
+    loop.run_until_complete(bench('cached multipart', paths, lambda path: cached_body(cache, path)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200, sys.argv[2] if len(sys.argv) > 2 else 'editor/assets')
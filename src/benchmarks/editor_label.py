@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Editor label benchmark: building and parsing of the legacy colon-joined and the versioned (v2) labels.
+#
+# Usage (from the `src` folder):
+#   $ python -m benchmarks.editor_label [n_ops]
+import random
+import sys
+import time
+
+from editor.main import pack_label, unpack_label
+from editor.utils import generate_user_name, generate_user_pass
+
+
+def legacy_label(checker_name, checker_pass, image_shape, image_id, emb_strategy):
+    return '{0}:{1}:{2}:{3}:{4}'.format(checker_name, checker_pass, image_shape, image_id, emb_strategy)
+
+
+def legacy_parse(label):
+    v = label.split(':')
+    checker_name, checker_pass, image_shape, image_id, emb_strategy = v[0], v[1], v[2], v[3], v[4]
+    image_shape = tuple(map(int, image_shape.replace('(', '').replace(')', '').split(',')))
+    return checker_name, checker_pass, image_shape, image_id, int(emb_strategy)
+
+
+def bench(name, n_ops, fn):
+    started = time.perf_counter()
+    for _ in range(n_ops):
+        fn()
+    elapsed = time.perf_counter() - started
+    print('{0:<36} {1:>12,.0f} ops/sec'.format(name, n_ops / elapsed))
+
+
+def main(n_ops):
+    rng = random.Random(0)
+    fields = (generate_user_name(rng), generate_user_pass(rng), (512, 768, 3), '1337', 3)
+    label, v2_label = legacy_label(*fields), pack_label(*fields)
+    print('label length: legacy={0}, v2={1}'.format(len(label), len(v2_label)))
+    assert legacy_parse(label) == unpack_label(label) == unpack_label(v2_label) == fields
+
+    bench('build (legacy)', n_ops, lambda: legacy_label(*fields))
+    bench('build (v2)', n_ops, lambda: pack_label(*fields))
+    bench('parse (legacy, old parser)', n_ops, lambda: legacy_parse(label))
+    bench('parse (legacy, new parser)', n_ops, lambda: unpack_label(label))
+    bench('parse (v2)', n_ops, lambda: unpack_label(v2_label))
+
+    # N.B. a password with a colon breaks the old parser
+    fields = fields[:1] + ('pa:ss(1, 2):' + fields[1],) + fields[2:]
+    assert unpack_label(legacy_label(*fields)) == unpack_label(pack_label(*fields)) == fields
+    try:
+        legacy_parse(legacy_label(*fields))
+        print('password with colons: parsed by the old parser')
+    except ValueError:
+        print('password with colons: rejected by the old parser')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Editor fake image benchmark: `Faker.image` (+ decode) vs the numpy synthesizer (+ a single encode).
+# N.B. `generate_fake_image` synthesizes arrays only, encoded fake images are still made by Faker
+#
+# Usage (from the `src` folder):
+#   $ python -m benchmarks.fake_images [n_images]
+import random
+import sys
+import time
+
+from faker import Faker
+
+from editor.utils import encode_png, generate_fake_image, image_raw_to_array, synthesize_image
+
+
+def faker_fake_image(fake, img_fmt, raw_data):
+    # N.B. the implementation `generate_fake_image` used to have
+    img_fmt = img_fmt if img_fmt != 'jpg' else 'jpeg'
+    width = random.randrange(512, 1024)
+    height = random.randrange(512, 1024)
+    image_data = fake.image(size=(width, height), image_format=img_fmt)
+    if raw_data:
+        return image_data, (height, width, 3)
+    else:
+        return image_raw_to_array(image_data), (height, width, 3)
+
+
+def bench(name, n_images, fn):
+    started = time.perf_counter()
+    for _ in range(n_images):
+        fn()
+    elapsed = time.perf_counter() - started
+    print('{0:<36} {1:>8.1f} images/sec'.format(name, n_images / elapsed))
+
+
+def main(n_images):
+    fake = Faker()
+    bench('Faker + decode (array)', n_images, lambda: faker_fake_image(fake, 'png', False))
+    bench('numpy (array)', n_images, lambda: generate_fake_image('png', False))
+    bench('Faker (png)', n_images, lambda: faker_fake_image(fake, 'png', True))
+    bench('numpy + encode_png (png)', n_images, lambda: encode_png(synthesize_image(random.randrange(512, 1024), random.randrange(512, 1024))))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Editor PNG encoding benchmark: `imsave` vs the fast-path encoder across zlib levels and filters.
+#
+# Usage (from the `src` folder):
+#   $ python -m benchmarks.png_encoding
+import glob
+import io
+import os
+import time
+
+from skimage.io import imread, imsave
+
+from editor.utils import encode_png, PNG_FILTERS
+
+ASSETS_FOLDER_PATH = os.getenv('EDITOR_ASSETS_FOLDER_PATH',
+                               os.path.join(os.path.dirname(os.path.dirname(__file__)), 'editor', 'assets'))
+
+
+def run(images, encode):
+    started = time.perf_counter()
+    size = sum(len(encode(image)) for image in images)
+    return time.perf_counter() - started, size
+
+
+def encode_imsave(image):
+    buf = io.BytesIO()
+    imsave(buf, image, format='png')
+    return buf.getvalue()
+
+
+def main():
+    images = [imread(path) for path in sorted(glob.glob(os.path.join(ASSETS_FOLDER_PATH, 'png', '*.png')))]
+    print('{0} images, {1:.1f} MB of raw pixels'.format(len(images), sum(i.nbytes for i in images) / 2 ** 20))
+
+    elapsed, size = run(images, encode_imsave)
+    print('{0:<16} {1:>8.1f} ms/image {2:>8.1f} MB'.format('imsave', 1000 * elapsed / len(images), size / 2 ** 20))
+    for png_filter in PNG_FILTERS:
+        for level in range(10):
+            elapsed, size = run(images, lambda image: encode_png(image, level, png_filter))
+            print('{0:<16} {1:>8.1f} ms/image {2:>8.1f} MB'.format(
+                '{0}, level={1}'.format(png_filter, level), 1000 * elapsed / len(images), size / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
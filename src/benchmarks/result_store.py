@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Result store benchmark: memory per recorded check and the time to aggregate the counters, for checks kept as
+#   tuples, as `Check` records (`__slots__`) and in the columnar `ResultStore` (numpy and plain loop aggregation).
+#
+# Usage (from the `src` folder):
+#   $ python -m benchmarks.result_store [n_checks]
+import random
+import sys
+import time
+import tracemalloc
+from array import array
+
+from simulator import results
+from simulator.results import Check, ResultStore
+from simulator.stats import RESULTS
+
+N_ROWS = 2 * 4 * 100
+MESSAGES = ('Failed to login', 'Connection error on POST /api/image', 'Wrong hash', 'Timeout')
+
+
+def generate(n_checks):
+    rng = random.Random(0)
+    for i in range(n_checks):
+        result = 0 if rng.random() < 0.9 else rng.randrange(1, len(RESULTS))
+        # N.B. the messages are built, as they come from the checkers, so that they aren't shared constants
+        message = ''.join(rng.choice(MESSAGES)) if result else ''
+        yield i // N_ROWS + 1, rng.randrange(N_ROWS), result, rng.random(), message
+
+
+def measure(name, n_checks, build):
+    tracemalloc.start()
+    checks = build(generate(n_checks))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{0:<28} {1:>8.1f} bytes/check'.format(name, size / n_checks))
+    return checks
+
+
+def aggregate_records(checks):
+    counters = array('Q', bytes(8 * N_ROWS * len(RESULTS)))
+    for check in checks:
+        counters[check[1] * len(RESULTS) + check[2]] += 1
+    return counters
+
+
+def aggregate_slots(checks):
+    counters = array('Q', bytes(8 * N_ROWS * len(RESULTS)))
+    for check in checks:
+        counters[check.row * len(RESULTS) + check.result] += 1
+    return counters
+
+
+def aggregate_store(store):
+    counters = array('Q', bytes(8 * N_ROWS * len(RESULTS)))
+    store.aggregate(0, counters, array('d', bytes(8 * N_ROWS)), {})
+    return counters
+
+
+def build_store(checks):
+    store = ResultStore(len(RESULTS))
+    for check in checks:
+        store.append(*check)
+    return store
+
+
+def bench(name, fn, checks):
+    started = time.perf_counter()
+    counters = fn(checks)
+    print('{0:<28} {1:>8.3f}s to aggregate'.format(name, time.perf_counter() - started))
+    return counters
+
+
+def main(n_checks):
+    tuples = measure('tuples', n_checks, list)
+    slots = measure('Check records (__slots__)', n_checks, lambda checks: [Check(*check) for check in checks])
+    store = measure('ResultStore', n_checks, build_store)
+
+    expected = bench('tuples', aggregate_records, tuples)
+    assert bench('Check records (__slots__)', aggregate_slots, slots) == expected
+    if results.get_numpy() is not None:
+        assert bench('ResultStore (numpy)', aggregate_store, store) == expected
+    results._numpy = False
+    assert bench('ResultStore (loop)', aggregate_store, store) == expected
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Cold start benchmark: interpreter start -> services loaded -> first PUSH finished.
+#
+# Usage (from the `src` folder):
+#   $ python -m benchmarks.startup [n_runs]
+#
+# Every run spawns a fresh interpreter, so nothing is cached in `sys.modules`. PUSHes are made against
+#   a closed local port, thus the first PUSH fails fast and only the checker's own startup cost is measured:
+#   the modules the PUSH would import lazily past the connection (DEFERRED_IMPORTS) are imported in the timed
+#   push phase instead, so that the deferred cost isn't left out.
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CHILD_CODE = '''\
+import asyncio, importlib, json, sys, time
+t0 = time.monotonic()
+import main
+services = main.load_services()
+t1 = time.monotonic()
+if services:
+    asyncio.get_event_loop().run_until_complete(
+        services[0].push('127.0.0.1', main.gen_capsule(), '', main.Metadata(1)))
+    for module_name in json.loads(sys.argv[1]).get(services[0].name, ()):
+        importlib.import_module(module_name)
+t2 = time.monotonic()
+print(json.dumps({'import': t1 - t0, 'push': t2 - t1}))
+'''
+
+CONFIGURATIONS = (
+    ('all services', ()),
+    ('editor only', ('SKIP_AESTHETIC', 'SKIP_MYBLOG', 'SKIP_JINNICE')),
+    ('aesthetic only', ('SKIP_EDITOR', 'SKIP_MYBLOG', 'SKIP_JINNICE')),
+    ('myblog only', ('SKIP_EDITOR', 'SKIP_AESTHETIC', 'SKIP_JINNICE')),
+    ('jinnice only', ('SKIP_EDITOR', 'SKIP_AESTHETIC', 'SKIP_MYBLOG')),
+)
+
+# N.B. modules a successful first PUSH imports on its way (image encoding, fake bios, the signature)
+DEFERRED_IMPORTS = {
+    'editor': ('faker', 'numpy', 'skimage.io'),
+    'aesthetic': ('jwt',),
+}
+
+CLOSED_PORT = '1'
+
+
+def run_once(skips):
+    env = {k: v for k, v in os.environ.items() if not k.startswith('SKIP_')}
+    env.update({skip: '' for skip in skips})
+    env.update({k: CLOSED_PORT for k in ('EDITOR_PORT', 'AESTHETIC_PORT', 'MYBLOG_PORT', 'JINNICE_PORT')})
+    env.update({'EDITOR_TIMEOUT': '1', 'AESTHETIC_TIMEOUT': '1', 'MYBLOG_TIMEOUT': '1', 'JINNICE_TIMEOUT': '1'})
+
+    started = time.monotonic()
+    out = subprocess.run([sys.executable, '-c', CHILD_CODE, json.dumps(DEFERRED_IMPORTS)], env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    total = time.monotonic() - started
+    timings = json.loads(out.decode().strip().splitlines()[-1])
+    timings['total'] = total
+    return timings
+
+
+def main(n_runs):
+    print('{0:<16} {1:>10} {2:>10} {3:>10}'.format('configuration', 'import', 'push', 'total'))
+    for name, skips in CONFIGURATIONS:
+        runs = [run_once(skips) for _ in range(n_runs)]
+        print('{0:<16} {1:>9.3f}s {2:>9.3f}s {3:>9.3f}s'.format(
+            name,
+            statistics.median(r['import'] for r in runs),
+            statistics.median(r['push'] for r in runs),
+            statistics.median(r['total'] for r in runs),
+        ))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Upload memory benchmark: peak RSS of the checker process vs the number of in-flight `Editor` uploads
+#   (a bundled PNG asset and an encoded 800x800 image each), buffered (the asset read into memory, the PNG
+#   joined, both wrapped into `FormData`) vs streamed (memory-mapped assets and the encoder's parts).
+#
+# Usage (from the `src` folder):
+#   $ python -m benchmarks.upload_memory [max_concurrency] [assets_folder_path]
+#
+# Every configuration runs in a fresh interpreter, as the peak RSS can't be reset, the RSS after loading the
+#   assets' metadata is subtracted. The bodies are written
+#   into a writer yielding to the loop after every chunk, so all the uploads are in flight at once.
+import json
+import os
+import subprocess
+import sys
+
+CHILD_CODE = '''\
+import asyncio, io, json, random, resource, sys
+import aiohttp
+from common.multipart import MultipartCache, form_body
+from editor.utils import asset_cache, encode_png, encode_png_parts, synthesize_image
+
+mode, concurrency, assets_folder_path = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+paths = asset_cache.listing(assets_folder_path, 'png')
+cache = MultipartCache()
+rng = random.Random(0)
+# N.B. a one time cost: shapes and hashes of the assets (and importing scikit-image to decode them)
+for path in paths:
+    asset_cache.load(path)
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class SlowWriter(object):
+    async def write(self, chunk):
+        await asyncio.sleep(0)
+
+
+def buffered_bodies(path):
+    with open(path, 'rb') as f:
+        asset = f.read()
+    image = encode_png(synthesize_image(800, 800, rng))
+    for data in (asset, image):
+        form = aiohttp.FormData()
+        form.add_field('image', io.BytesIO(data), filename='image.png', content_type='image/png')
+        form.add_field('name', 'a1b2c3d4e5f6')
+        yield form()
+
+
+def streamed_bodies(path):
+    asset = asset_cache.load(path)
+    yield cache.body(asset.digest, asset.read(), 'image', 'image.png', 'image/png', [('name', 'a1b2c3d4e5f6')])
+    parts = encode_png_parts(synthesize_image(800, 800, rng))
+    yield form_body('image', 'image.png', 'image/png', parts, [('name', 'a1b2c3d4e5f6')])
+
+
+async def upload(path):
+    for body in (buffered_bodies if mode == 'buffered' else streamed_bodies)(path):
+        await body.write(SlowWriter())
+
+
+async def run():
+    await asyncio.gather(*(upload(paths[i % len(paths)]) for i in range(concurrency)))
+
+asyncio.get_event_loop().run_until_complete(run())
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'baseline': baseline / 1024, 'peak': peak / 1024}))
+'''
+
+
+def run_once(mode, concurrency, assets_folder_path):
+    # N.B. assets are never kept in memory, so that the streamed mode uploads them from the mapped files
+    env = dict(os.environ, EDITOR_ASSET_CACHE_SIZE='0')
+    out = subprocess.run([sys.executable, '-W', 'ignore', '-c', CHILD_CODE, mode, str(concurrency),
+                          assets_folder_path], env=env, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main(max_concurrency, assets_folder_path):
+    print('{0:>11} {1:>14} {2:>14}'.format('concurrency', 'buffered', 'streamed'))
+    concurrency = 1
+    while concurrency <= max_concurrency:
+        runs = [run_once(mode, concurrency, assets_folder_path) for mode in ('buffered', 'streamed')]
+        print('{0:>11} {1:>10.1f} MiB {2:>10.1f} MiB'.format(
+            concurrency, *(r['peak'] - r['baseline'] for r in runs)))
+        concurrency *= 4
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 64, sys.argv[2] if len(sys.argv) > 2 else 'editor/assets')
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+
+async def run_batch(pulls, concurrency, shared_time=0.0):
+    # Runs the PULLs of a batch (coroutines returning (result, message)) at most `concurrency` at a time,
+    #   returns [(result, message, elapsed), ...] in order: the time of every PULL plus its share of the
+    #   `shared_time` the batch spent on the steps common to all of them (a ping, a listing...)
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    pulls = list(pulls)
+    share = shared_time / len(pulls) if pulls else 0.0
+
+    async def timed(pull):
+        try:
+            async with semaphore:
+                started = time.monotonic()
+                result, message = await pull
+                return result, message, time.monotonic() - started + share
+        finally:
+            # N.B. a PULL cancelled while waiting for its turn has never started
+            pull.close()
+
+    return await asyncio.gather(*(timed(pull) for pull in pulls))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+# N.B. where a checker runs its blocking or CPU-bound steps (declared in the checker's PROFILE):
+#      `loop` - inline on the event loop, `thread` - a shared thread pool (blocking sockets, files),
+#      `process` - a shared process pool (image encoding and the like; the function, its arguments and
+#      its result must be picklable)
+EXECUTOR_LOOP = 'loop'
+EXECUTOR_THREAD = 'thread'
+EXECUTOR_PROCESS = 'process'
+EXECUTORS = (EXECUTOR_LOOP, EXECUTOR_THREAD, EXECUTOR_PROCESS)
+
+EXECUTOR_THREADS = int(os.getenv('EXECUTOR_THREADS', 8))
+EXECUTOR_PROCESSES = int(os.getenv('EXECUTOR_PROCESSES', os.cpu_count() or 1))
+
+_pools = {}
+_lock = threading.Lock()
+
+# N.B. the executors the simulator resolved for the checkers' operations (declared or overridden), keyed by
+#      (checker module name, operation); a checker run outside the simulator uses its declared executor
+_assigned = {}
+
+# N.B. (service, operation) of the running check, set by the simulator: the thread pool threads publish it in
+#      `running_checks` (keyed by the thread id) while running the check's work, so that the profiler can
+#      attribute their samples
+current_check = contextvars.ContextVar('current_check', default=None)
+running_checks = {}
+
+
+def _run_as(check, fn, *args, **kwargs):
+    ident = threading.get_ident()
+    running_checks[ident] = check
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        running_checks.pop(ident, None)
+
+
+def assign_executor(module_name, operation, executor):
+    _assigned[(module_name, operation)] = executor
+
+
+def executor_for(module_name, operation, declared):
+    return _assigned.get((module_name, operation), declared)
+
+
+def get_pool(executor):
+    with _lock:
+        pool = _pools.get(executor)
+        if pool is None:
+            if executor == EXECUTOR_THREAD:
+                pool = concurrent.futures.ThreadPoolExecutor(EXECUTOR_THREADS, thread_name_prefix='checker')
+            elif executor == EXECUTOR_PROCESS:
+                pool = concurrent.futures.ProcessPoolExecutor(EXECUTOR_PROCESSES)
+            else:
+                raise ValueError('Unknown executor: {0}'.format(executor))
+            _pools[executor] = pool
+        return pool
+
+
+async def run_in_executor(executor, fn, *args, **kwargs):
+    if executor == EXECUTOR_LOOP:
+        return fn(*args, **kwargs)
+    pool = get_pool(executor)
+    check = current_check.get()
+    if check is not None and executor == EXECUTOR_THREAD:
+        fn, args = _run_as, (check, fn) + args
+    try:
+        return await asyncio.get_event_loop().run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+    except BrokenProcessPool:
+        # N.B. a worker died (e.g. killed by the OOM killer), the next call starts a new pool
+        with _lock:
+            if _pools.get(executor) is pool:
+                del _pools[executor]
+        raise
+
+
+def shutdown(wait=True):
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=wait)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from volgactf.final.checker.result import Result
+
+
+class TeamHealth(object):
+    __slots__ = ('round_number', 'probe', 'failures', 'next_round')
+
+    def __init__(self):
+        self.round_number = None
+        self.probe = None
+        self.failures = 0
+        self.next_round = None
+
+
+class HealthProber(object):
+    # Per-team health of a service, probed once per round: the checks of a team in a round share the probe's
+    #   result (concurrent checks share the probe in flight), a check runs its flows only if the probe is UP.
+    #   After `threshold` consecutive failed probes the team is deemed hard down: for the next 1, 2, 4... rounds
+    #   (up to `max_backoff`, 0 - no backoff) it's probed the quick way (e.g. with a short timeout), so that a
+    #   recovery is still noticed the next round, but a hanging service doesn't hold every check for long
+    #   N.B. a check without a round number is always probed the usual way and doesn't update the team's health
+    def __init__(self, threshold, max_backoff):
+        self.threshold = threshold
+        self.max_backoff = max_backoff
+        self._teams = {}
+
+    def backing_off(self, team, round_number):
+        health = self._teams.get(team)
+        return health is not None and health.next_round is not None and round_number < health.next_round
+
+    async def check(self, team, round_number, probe):
+        # probe: a coroutine function `probe(quick)` returning the Result of the team's service
+        if round_number is None:
+            return await probe(False)
+        health = self._teams.setdefault(team, TeamHealth())
+        if health.round_number != round_number:
+            quick = self.backing_off(team, round_number)
+            health.round_number = round_number
+            health.probe = asyncio.ensure_future(self._probe(health, round_number, probe, quick))
+        # N.B. a cancelled check doesn't cancel the probe the others are waiting for
+        return await asyncio.shield(health.probe)
+
+    async def _probe(self, health, round_number, probe, quick):
+        try:
+            result = await probe(quick)
+        except Exception:
+            result = Result.DOWN
+        if result == Result.UP:
+            health.failures, health.next_round = 0, None
+        else:
+            health.failures += 1
+            if self.max_backoff > 0 and health.failures >= self.threshold:
+                health.next_round = round_number + 1 + min(2 ** (health.failures - self.threshold), self.max_backoff)
+        return result
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+
+class ListingCache(object):
+    # Per-team cache of listing responses, kept as indexes (sets or dicts) for O(1) membership checks.
+    #   An entry expires `ttl` seconds after it has been fetched, or as soon as the team's listings are
+    #   invalidated (after a PUSH has changed them)
+    #   N.B. concurrent misses of the same listing share one fetch
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._teams = {}
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    async def get(self, team, listing, fetch):
+        # fetch: a coroutine function returning the index, or None if the listing couldn't be fetched (not cached)
+        if not self.enabled:
+            return await fetch()
+        entries = self._teams.setdefault(team, {})
+        entry = entries.get(listing)
+        if isinstance(entry, tuple):
+            index, expires_at = entry
+            if expires_at >= time.monotonic():
+                return index
+            entry = None
+        if entry is None:
+            entry = asyncio.ensure_future(self._fetch(team, listing, fetch))
+            entries[listing] = entry
+        # N.B. a cancelled check doesn't cancel the fetch the others are waiting for
+        return await asyncio.shield(entry)
+
+    async def _fetch(self, team, listing, fetch):
+        task = asyncio.current_task()
+        try:
+            index = await fetch()
+        finally:
+            # N.B. a fetch overtaken by an invalidation isn't stored, the listing may predate the PUSH
+            entries = self._teams.get(team)
+            current = entries is not None and entries.get(listing) is task
+            if current:
+                del entries[listing]
+        if current and index is not None:
+            entries[listing] = (index, time.monotonic() + self.ttl)
+        return index
+
+    def invalidate(self, team):
+        self._teams.pop(team, None)
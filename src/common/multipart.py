@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import collections
+import threading
+import uuid
+
+from aiohttp import payload
+
+from .streams import CHUNK_SIZE
+
+PART_CACHE_SIZE = 256
+
+
+def quote(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class MultipartBody(payload.Payload):
+    # N.B. a multipart/form-data body made of ready parts (bytes, memory-mapped files, encoder outputs) written
+    #      one by one in chunks of at most CHUNK_SIZE bytes: the parts are never copied into a single buffer,
+    #      and the writer waits for the transport to drain between the chunks
+    def __init__(self, parts, boundary):
+        super().__init__(parts, content_type='multipart/form-data; boundary={0}'.format(boundary))
+        self._size = sum(len(part) for part in parts)
+
+    async def write(self, writer):
+        for part in self._value:
+            if len(part) <= CHUNK_SIZE:
+                await writer.write(part)
+                continue
+            view = memoryview(part)
+            try:
+                for start in range(0, len(view), CHUNK_SIZE):
+                    await writer.write(view[start:start + CHUNK_SIZE])
+            finally:
+                view.release()
+
+    def decode(self, encoding='utf-8', errors='strict'):
+        return b''.join(self._value).decode(encoding, errors)
+
+
+class MultipartCache(object):
+    # Prebuilt file part headers (with the boundary checked against the file) keyed by the file's content hash
+    #   and the part's field name, filename and content type. Only the small text fields are built per request
+    def __init__(self, max_size=PART_CACHE_SIZE):
+        self.max_size = max_size
+        self._parts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def file_part(self, digest, data, field_name, filename, content_type):
+        key = (digest, field_name, filename, content_type)
+        with self._lock:
+            part = self._parts.get(key)
+            if part is not None:
+                self._parts.move_to_end(key)
+                return part
+
+        # N.B. the boundary is chosen once per file, it must not occur in the file itself
+        boundary = uuid.uuid4().hex
+        while data.find(boundary.encode('ascii')) != -1:
+            boundary = uuid.uuid4().hex
+        part = (boundary, file_head(boundary, field_name, filename, content_type))
+        with self._lock:
+            self._parts[key] = part
+            while len(self._parts) > self.max_size:
+                self._parts.popitem(last=False)
+        return part
+
+    def body(self, digest, data, field_name, filename, content_type, fields):
+        boundary, head = self.file_part(digest, data, field_name, filename, content_type)
+        return build_body(boundary, head, [data], fields)
+
+
+def file_head(boundary, field_name, filename, content_type):
+    # N.B. just like aiohttp's FormData for a file object without a name, the field name is the default filename
+    return ('--{0}\r\nContent-Type: {1}\r\nContent-Disposition: form-data; name="{2}"; filename="{3}"\r\n\r\n'
+            .format(boundary, content_type, quote(field_name), quote(filename or field_name))).encode('utf-8')
+
+
+def build_body(boundary, head, file_parts, fields):
+    # N.B. returns None if a text field contains the boundary (the caller falls back to FormData then)
+    parts = [head, *file_parts, b'\r\n']
+    for name, value in fields:
+        if boundary in value:
+            return None
+        parts.append('--{0}\r\nContent-Disposition: form-data; name="{1}"\r\n\r\n{2}\r\n'
+                     .format(boundary, quote(name), value).encode('utf-8'))
+    parts.append('--{0}--\r\n'.format(boundary).encode('ascii'))
+    return MultipartBody(parts, boundary)
+
+
+def form_body(field_name, filename, content_type, file_parts, fields=()):
+    # N.B. a body for generated data (not checked for the boundary, just like aiohttp's FormData)
+    boundary = uuid.uuid4().hex
+    return build_body(boundary, file_head(boundary, field_name, filename, content_type), file_parts, fields)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+
+from .seeding import SEED
+
+POOL_SIZE = int(os.getenv('FAKE_PROFILE_POOL_SIZE', 1024))
+BIO_MIN_WORDS, BIO_MAX_WORDS = 5, 20
+
+
+class ProfilePool(object):
+    # N.B. Faker's provider dispatch is slow compared to the rest of a check, so user agents, names and bios
+    #      are generated once and then sampled from the pool by all the checkers. The simulator builds the pool
+    #      on startup (see simulator/registry.py), a checker run on its own builds it on first use
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self.user_agents = None
+        self.first_names = None
+        self.last_names = None
+        self.bios = None
+
+    @property
+    def built(self):
+        return self.user_agents is not None
+
+    def build(self):
+        from faker import Faker
+        fake = Faker()
+        rng = random
+        if SEED is not None:
+            fake.seed_instance(SEED)
+            rng = random.Random(SEED)
+        self.user_agents = [fake.user_agent() for _ in range(self.size)]
+        self.first_names = [fake.first_name() for _ in range(self.size)]
+        self.last_names = [fake.last_name() for _ in range(self.size)]
+        self.bios = [fake.sentence(nb_words=rng.randrange(BIO_MIN_WORDS, BIO_MAX_WORDS))
+                     for _ in range(self.size)]
+
+    def _sample(self, attr, rng):
+        if not self.built:
+            self.build()
+        return rng.choice(getattr(self, attr))
+
+    def user_agent(self, rng=random):
+        return self._sample('user_agents', rng)
+
+    def first_name(self, rng=random):
+        return self._sample('first_names', rng)
+
+    def last_name(self, rng=random):
+        return self._sample('last_names', rng)
+
+    def bio(self, rng=random):
+        return self._sample('bios', rng)
+
+
+profiles = ProfilePool()
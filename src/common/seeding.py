@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import secrets
+from uuid import uuid4
+
+# N.B. if set, every check draws from its own generator derived from the seed, the round, the service and
+#      the check, so that two runs with the same seed produce the same workload
+SEED = os.getenv('SEED')
+
+
+def check_rng(seed, round_number, service_name, operation, index=0):
+    return random.Random('{0}:{1}:{2}:{3}:{4}'.format(seed, round_number, service_name, operation, index))
+
+
+def get_rng(metadata):
+    # N.B. Themis' metadata has no generator, the global one is used then
+    return getattr(metadata, 'rng', None) or random
+
+
+def seeded(rng):
+    return rng is not random
+
+
+def random_hex(rng, length=32):
+    if not seeded(rng):
+        return uuid4().hex[:length]
+    return '{0:032x}'.format(rng.getrandbits(128))[:length]
+
+
+def random_bytes(rng, n):
+    if not seeded(rng):
+        return os.urandom(n)
+    return rng.getrandbits(8 * n).to_bytes(n, 'big')
+
+
+def secure_choice(rng, seq):
+    if not seeded(rng):
+        return secrets.choice(seq)
+    return rng.choice(seq)
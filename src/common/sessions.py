@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import collections
+import time
+
+
+class SessionCache(object):
+    # LRU cache of authenticated aiohttp sessions, a session expires `ttl` seconds after it has been put
+    # N.B. the evicted and expired sessions are closed by the cache
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sessions = collections.OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl > 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    async def get(self, key):
+        # N.B. the session is checked out of the cache until it's put back, so concurrent checks of the same key
+        #      never share a session (the ones that miss log in anew)
+        item = self._sessions.pop(key, None)
+        if item is None:
+            return None
+        session, expires_at = item
+        if session.closed or expires_at < time.monotonic():
+            await session.close()
+            return None
+        return session
+
+    async def put(self, key, session):
+        if not self.enabled:
+            await session.close()
+            return
+        # N.B. the cache is updated before closing anything, so that concurrent puts don't lose sessions
+        evicted = []
+        previous = self._sessions.pop(key, None)
+        if previous is not None and previous[0] is not session:
+            evicted.append(previous[0])
+        self._sessions[key] = (session, time.monotonic() + self.ttl)
+        while len(self._sessions) > self.max_size:
+            evicted.append(self._sessions.popitem(last=False)[1][0])
+        for evicted_session in evicted:
+            await evicted_session.close()
+
+    async def discard(self, key):
+        item = self._sessions.pop(key, None)
+        if item is not None:
+            await item[0].close()
+
+    async def close(self):
+        while self._sessions:
+            _, (session, _) = self._sessions.popitem()
+            await session.close()
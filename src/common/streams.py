@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import os
+
+CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 1 << 16))
+
+
+class BodyTooLargeError(Exception):
+    pass
+
+
+async def iter_body(response, max_size, chunk_size=CHUNK_SIZE):
+    # N.B. the body is never buffered as a whole: a hostile server can't make the checker hold more than
+    #      `max_size` bytes, the download is aborted as soon as the limit is exceeded
+    if response.content_length is not None and response.content_length > max_size:
+        raise BodyTooLargeError('Response body is too large: Content-Length={0}, limit={1}'
+                                .format(response.content_length, max_size))
+    received = 0
+    async for chunk in response.content.iter_chunked(chunk_size):
+        received += len(chunk)
+        if received > max_size:
+            raise BodyTooLargeError('Response body is too large: received more than {0} bytes'.format(max_size))
+        yield chunk
+
+
+async def read_body(response, max_size, chunk_size=CHUNK_SIZE):
+    body = bytearray()
+    async for chunk in iter_body(response, max_size, chunk_size=chunk_size):
+        body += chunk
+    return bytes(body)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import atexit
+import itertools
+import os
+import struct
+import functools
+import threading
+import time
+import weakref
+
+TRACE_PATH = os.getenv('TRACE_PATH')
+TRACE_MAX_PAYLOAD = int(os.getenv('TRACE_MAX_PAYLOAD', 4096))
+
+# N.B. a trace is the magic followed by records: a fixed header and the variable fields it announces
+#      (service, method, target, headers, payload). HTTP records store a URL template with the team's
+#      address replaced by `{endpoint}`, frame records store a `SEND`/`RECV` method and a `{endpoint}:port`
+#      target. Requests are grouped into flows (one per client session or socket), so that a flow can be
+#      replayed on its own connection with its own cookies. Payloads larger than TRACE_MAX_PAYLOAD are not
+#      stored, only their size. A run truncates the trace, so that the flow ids of different runs don't mix.
+MAGIC = b'VCTRACE1'
+RECORD_HEADER = struct.Struct('<BIddIIhHHHHI')
+RECORD_HTTP = 1
+RECORD_FRAME = 2
+STATUS_ERROR = -1
+
+ENDPOINT = '{endpoint}'
+# N.B. request headers needed to replay a request: the body's type (with the multipart boundary) and cookies
+#      set without a cookie jar
+RECORDED_HEADERS = ('Content-Type', 'Cookie')
+
+
+class Record(object):
+    __slots__ = ('kind', 'flow', 'started', 'duration', 'sent', 'received', 'status', 'service', 'method',
+                 'target', 'headers', 'payload')
+
+    def __init__(self, kind, flow, started, duration, sent, received, status, service, method, target,
+                 headers='', payload=b''):
+        self.kind = kind
+        self.flow = flow
+        self.started = started
+        self.duration = duration
+        self.sent = sent
+        self.received = received
+        self.status = status
+        self.service = service
+        self.method = method
+        self.target = target
+        self.headers = headers
+        self.payload = payload
+
+    def pack(self):
+        service, method, target, headers = (s.encode('utf-8') for s in (
+            self.service, self.method, self.target, self.headers))
+        return b''.join((
+            RECORD_HEADER.pack(self.kind, self.flow, self.started, self.duration, self.sent, self.received,
+                               self.status, len(service), len(method), len(target), len(headers),
+                               len(self.payload)),
+            service, method, target, headers, self.payload,
+        ))
+
+
+class TraceRecorder(object):
+    def __init__(self, path=TRACE_PATH, max_payload=TRACE_MAX_PAYLOAD):
+        self.path = path
+        self.max_payload = max_payload
+        self._file = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._flows = weakref.WeakKeyDictionary()
+        self._flow_ids = itertools.count(1)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def flow(self, owner):
+        # N.B. client sessions and sockets are weakly referenced, so a flow id is never reused within a trace
+        with self._lock:
+            flow = self._flows.get(owner)
+            if flow is None:
+                flow = self._flows[owner] = next(self._flow_ids)
+            return flow
+
+    def write(self, record):
+        data = record.pack()
+        with self._lock:
+            # N.B. a record coming after the trace has been closed (a response released at exit) is dropped,
+            #      reopening the trace would truncate it
+            if self._closed:
+                return
+            if self._file is None:
+                self._file = open(self.path, 'wb')
+                self._file.write(MAGIC)
+            self._file.write(data)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+recorder = TraceRecorder()
+atexit.register(recorder.close)
+
+
+def read_trace(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{0} is not a trace file'.format(path))
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            kind, flow, started, duration, sent, received, status, *lengths = RECORD_HEADER.unpack(header)
+            service, method, target, headers = (f.read(n).decode('utf-8') for n in lengths[:4])
+            yield Record(kind, flow, started, duration, sent, received, status, service, method, target,
+                         headers, f.read(lengths[4]))
+
+
+# region HTTP
+
+def url_template(url):
+    return '{0}://{1}:{2}{3}'.format(url.scheme, ENDPOINT, url.port, url.raw_path_qs)
+
+
+def pack_headers(headers):
+    return '\r\n'.join('{0}: {1}'.format(name, headers[name]) for name in RECORDED_HEADERS if name in headers)
+
+
+def unpack_headers(s):
+    return dict(line.split(': ', 1) for line in s.split('\r\n') if line)
+
+
+def trace_configs(service_name):
+    # N.B. to be passed to `aiohttp.ClientSession(trace_configs=...)`, empty if recording is disabled
+    if not recorder.enabled:
+        return []
+    import aiohttp
+
+    async def on_request_start(session, ctx, params):
+        ctx.flow = recorder.flow(session)
+        ctx.started = time.time()
+        ctx.sent = 0
+        ctx.payload = bytearray()
+
+    async def on_request_chunk_sent(session, ctx, params):
+        ctx.sent += len(params.chunk)
+        if ctx.payload is not None:
+            ctx.payload += params.chunk
+            if len(ctx.payload) > recorder.max_payload:
+                ctx.payload = None
+
+    def record(ctx, method, url, status, headers, received=0):
+        recorder.write(Record(
+            RECORD_HTTP, ctx.flow, ctx.started, time.time() - ctx.started, ctx.sent, received, status,
+            service_name, method, url_template(url), headers,
+            bytes(ctx.payload) if ctx.payload is not None else b'',
+        ))
+
+    async def on_request_end(session, ctx, params):
+        # N.B. the request ends as soon as the response headers are received, so the record is written once
+        #      the response releases its connection (its body read or dropped) to get the actual size and timing
+        response = params.response
+        write = functools.partial(record, ctx, params.method, params.url, response.status,
+                                  pack_headers(response.request_info.headers))
+        if response.connection is None:
+            # N.B. a response without a body has released its connection already
+            write(response.content.total_bytes)
+        else:
+            response.connection.add_callback(lambda: write(response.content.total_bytes))
+
+    async def on_request_exception(session, ctx, params):
+        record(ctx, params.method, params.url, STATUS_ERROR, '')
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return [trace_config]
+
+
+# endregion HTTP
+
+# region Frames
+
+def record_frame(service_name, s, method, size, started, payload=b''):
+    try:
+        port = s.getpeername()[1]
+    except OSError:
+        port = 0
+    recorder.write(Record(
+        RECORD_FRAME, recorder.flow(s), started, time.time() - started, size if method == 'SEND' else 0,
+        size if method == 'RECV' else 0, 0, service_name, method, '{0}:{1}'.format(ENDPOINT, port), '',
+        payload if len(payload) <= recorder.max_payload else b'',
+    ))
+
+# endregion Frames
@@ -1,22 +1,33 @@
 # -*- coding: utf-8 -*-
 import base64
+import binascii
 import io
 import logging
 import os
 import random
+import struct
+import time
 
 import aiohttp
 from volgactf.final.checker.result import Result
 
+from common.batches import run_batch
+from common.executors import EXECUTOR_LOOP, EXECUTOR_PROCESS, executor_for, run_in_executor
+from common.multipart import MultipartCache, form_body
+from common.seeding import get_rng, seeded
+from common.sessions import SessionCache
+from common.streams import iter_body
+from common.trace import trace_configs
+from .strategies import StrategyScheduler
 from .utils import (
     decode_if_unicode,
     coin_flip,
     generate_user_name, generate_user_pass,
     generate_first_name, generate_last_name, generate_bio,
     get_random_user_agent,
-    generate_image_name, generate_image,
+    generate_image_name, generate_raw_image, encode_capsule_image,
     image_raw_to_array, image_array_to_raw,
-    embed_lsb, extract_lsb
+    embed_lsb, extract_lsb, PngLsbReader
 )
 
 logger = logging.getLogger(__name__)
@@ -27,6 +38,12 @@ PORT = int(os.getenv('EDITOR_PORT', 8080))
 SESSION_TOTAL_TIMEOUT = int(os.getenv('EDITOR_TIMEOUT', 30))
 N_MAX_IMAGES_PER_PUSH = int(os.getenv('EDITOR_N_MAX_IMAGES_PER_PUSH', 3))
 ASSETS_FOLDER_PATH = os.getenv('EDITOR_ASSETS_FOLDER_PATH', '/dist/editor/assets')
+MAX_IMAGE_SIZE = int(os.getenv('EDITOR_MAX_IMAGE_SIZE', 16 * 1024 * 1024))
+SESSION_CACHE_SIZE = int(os.getenv('EDITOR_SESSION_CACHE_SIZE', 0))
+SESSION_CACHE_TTL = int(os.getenv('EDITOR_SESSION_CACHE_TTL', 300))
+PULL_BATCH_CONNECTIONS = int(os.getenv('EDITOR_PULL_BATCH_CONNECTIONS', 2))
+STRATEGY_WINDOW = int(os.getenv('EDITOR_STRATEGY_WINDOW', 6))
+STRATEGY_BUDGET = float(os.getenv('EDITOR_STRATEGY_BUDGET', 0))
 
 IMAGE_MULTIPART_FILENAME = 'image'
 
@@ -36,6 +53,7 @@ LOGIN_RET_CODE_OK = 200
 LOGIN_RET_CODE_INVALID = 400
 LOGOUT_RET_CODE_OK = 200
 GET_IMAGE_RET_CODE_OK = 200
+GET_IMAGE_RET_CODE_UNAUTHORIZED = 401
 DOWNLOAD_IMAGE_RET_CODE_OK = 200
 
 REGISTER_URI_FMT = os.getenv('REGISTER_URI_FMT', 'http://{endpoint}:{port}/signup')
@@ -48,28 +66,108 @@ GET_IMAGE_CONTENTS_FMT = os.getenv('GET_IMAGE_CONTENTS_FMT', 'http://{endpoint}:
 
 # endregion Environment variables
 
+# N.B. resource profile of the operations, read by the simulator (see simulator/registry.py): PUSH encodes
+#      the capsule into a PNG, PULL only decodes the scanlines holding it while the image is downloaded
+PROFILE = {
+    'push': {'cpu_heavy': True, 'io_bound': True, 'max_concurrency': 4, 'executor': EXECUTOR_PROCESS},
+    'pull': {'cpu_heavy': False, 'io_bound': True, 'max_concurrency': 8, 'executor': EXECUTOR_LOOP},
+}
+
+# N.B. multipart bodies of the bundled assets are built around the cached file bytes and part headers
+multipart_cache = MultipartCache()
+
+# N.B. sessions authenticated on PUSH are reused by the PULLs of the same user (disabled if the size is 0)
+session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+
+# N.B. the strategy of a PUSH balances the strategies' coverage per team against the CPU spent per round
+strategy_scheduler = StrategyScheduler(STRATEGY_WINDOW, STRATEGY_BUDGET)
+
+# N.B. connections shared by the sessions of the batched PULLs, per team (see pull_many)
+batch_connectors = {}
+
+
+def new_session(connector=None):
+    # N.B. a session on a shared connector (see pull_many) doesn't close it
+    return aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True),
+                                 timeout=aiohttp.ClientTimeout(total=SESSION_TOTAL_TIMEOUT),
+                                 skip_auto_headers={'User-Agent'},
+                                 trace_configs=trace_configs('editor'),
+                                 connector=connector, connector_owner=connector is None)
+
+
+LABEL_VERSION = 'v2'
+# N.B. strategy, image height, width and channels (0 for a grayscale image), base64-encoded
+LABEL_HEADER = struct.Struct('>BIIH')
+
+
+def pack_label(checker_name, checker_pass, image_shape, image_id, emb_strategy):
+    # `v2:header:name:image_id:pass`
+    # N.B. the password goes last, so that it may contain colons
+    height, width = image_shape[:2]
+    header = LABEL_HEADER.pack(emb_strategy, height, width, image_shape[2] if len(image_shape) > 2 else 0)
+    return '{0}:{1}:{2}:{3}:{4}'.format(LABEL_VERSION, binascii.b2a_base64(header, newline=False).decode(),
+                                        checker_name, image_id, checker_pass)
+
+
+def unpack_label(label):
+    # returns (checker_name, checker_pass, image_shape, image_id, emb_strategy)
+    v = label.split(':', 4)
+    if v[0] != LABEL_VERSION:
+        # N.B. labels of the flags pushed before the versioned format was introduced
+        return unpack_legacy_label(label)
+    if len(v) != 5:
+        raise ValueError('Incorrect label: {0}'.format(label))
+    emb_strategy, height, width, channels = LABEL_HEADER.unpack(binascii.a2b_base64(v[1]))
+    image_shape = (height, width, channels) if channels else (height, width)
+    return v[2], v[4], image_shape, v[3], emb_strategy
+
+
+def unpack_legacy_label(label):
+    # `name:pass:(height, width, channels):image_id:strategy`
+    # N.B. only the password may contain colons: the name is hex, the shape has none, the rest are numbers
+    checker_name, rest = label.split(':', 1)
+    rest, image_id, emb_strategy = rest.rsplit(':', 2)
+    checker_pass, image_shape = rest.rsplit(':', 1)
+    image_shape = tuple(int(v) for v in image_shape.strip('()').split(',') if v.strip())
+    return checker_name, checker_pass, image_shape, image_id, int(emb_strategy)
+
 
 # region Payload generation and capsule checking
 
-def generate_post_image_requests(capsule):
-    n_images = random.randrange(1, N_MAX_IMAGES_PER_PUSH + 1)
+async def generate_post_image_requests(capsule, emb_strategy=None, rng=random):
+    n_images = rng.randrange(1, N_MAX_IMAGES_PER_PUSH + 1)
     strategies = [0 for _ in range(n_images)]
-    save_into_index = random.randrange(n_images)
-    strategies[save_into_index] = None
+    save_into_index = rng.randrange(n_images)
+    strategies[save_into_index] = emb_strategy
 
     datas, post_image_infos = [], []
-    for emb_strategy in strategies:
-        post_image_info = generate_post_image_request(capsule, emb_strategy=emb_strategy)
-        data = aiohttp.FormData()
-        data.add_field(
-            IMAGE_MULTIPART_FILENAME,
-            io.BytesIO(post_image_info['image_data']),
-            filename=post_image_info['filename'],
-            content_type=post_image_info['content_type']
-        )
-        data.add_field('name', post_image_info['name'])
+    for i, emb_strategy in enumerate(strategies):
+        started = time.perf_counter()
+        post_image_info = await generate_post_image_request(capsule, emb_strategy=emb_strategy, rng=rng)
+        if i == save_into_index:
+            strategy_scheduler.observe(post_image_info['emb_strategy'], 'push', time.perf_counter() - started)
+        fields = [('name', post_image_info['name'])]
         if post_image_info['about'] is not None:
-            data.add_field('about', post_image_info['about'])
+            fields.append(('about', post_image_info['about']))
+
+        # N.B. the image is written from the cached asset, the memory-mapped file or the encoder's output parts
+        image_parts = post_image_info['image_data']
+        if post_image_info['digest'] is not None:
+            data = multipart_cache.body(post_image_info['digest'], image_parts[0], IMAGE_MULTIPART_FILENAME,
+                                        post_image_info['filename'], post_image_info['content_type'], fields)
+        else:
+            data = form_body(IMAGE_MULTIPART_FILENAME, post_image_info['filename'], post_image_info['content_type'],
+                             image_parts, fields)
+        if data is None:
+            data = aiohttp.FormData()
+            data.add_field(
+                IMAGE_MULTIPART_FILENAME,
+                io.BytesIO(b''.join(image_parts)),
+                filename=post_image_info['filename'],
+                content_type=post_image_info['content_type']
+            )
+            for name, value in fields:
+                data.add_field(name, value)
 
         datas.append(data)
         post_image_infos.append(post_image_info)
@@ -78,24 +176,27 @@ def generate_post_image_requests(capsule):
     return datas, post_image_info, save_into_index
 
 
-def generate_post_image_request(capsule, emb_strategy=None):
+async def generate_post_image_request(capsule, emb_strategy=None, rng=random):
     im_rec = {
-        'name': generate_image_name(),
+        'name': generate_image_name(rng),
         'about': None,  # N.B. about is optional
         'image_shape': None,
-        'image_data': None,
+        'image_data': None,  # N.B. a list of parts, written one by one
         'filename': None,
         'content_type': None,
-        'emb_strategy': random.randrange(1, 4) if emb_strategy is None else emb_strategy
+        'digest': None,  # N.B. content hash of a bundled asset (uploaded as is)
+        'emb_strategy': rng.randrange(1, 4) if emb_strategy is None else emb_strategy
     }
 
     # generate capsule embedding according to the strategy
     if im_rec['emb_strategy'] == 0:
         # jpg image, capsule in about field
         im_rec['content_type'] = 'image/jpeg'
-        if coin_flip():
-            im_rec['about'] = generate_bio()
-        im_rec['image_data'], im_rec['image_shape'] = generate_image(ASSETS_FOLDER_PATH, image_format='jpg')
+        if coin_flip(rng):
+            im_rec['about'] = generate_bio(rng)
+        image_data, im_rec['image_shape'], im_rec['digest'] = \
+            generate_raw_image(ASSETS_FOLDER_PATH, image_format='jpg', rng=rng)
+        im_rec['image_data'] = [image_data]
         im_rec['filename'] = 'image.jpg'
         return im_rec
 
@@ -103,7 +204,9 @@ def generate_post_image_request(capsule, emb_strategy=None):
         # jpg image, capsule in about field
         im_rec['content_type'] = 'image/jpeg'
         im_rec['about'] = base64.b64encode(capsule.encode('utf-8')).decode('utf-8')
-        im_rec['image_data'], im_rec['image_shape'] = generate_image(ASSETS_FOLDER_PATH, image_format='jpg')
+        image_data, im_rec['image_shape'], im_rec['digest'] = \
+            generate_raw_image(ASSETS_FOLDER_PATH, image_format='jpg', rng=rng)
+        im_rec['image_data'] = [image_data]
         im_rec['filename'] = 'image.jpg'
         return im_rec
 
@@ -111,7 +214,9 @@ def generate_post_image_request(capsule, emb_strategy=None):
         # png image, capsule in about field
         im_rec['content_type'] = 'image/png'
         im_rec['about'] = base64.b64encode(capsule.encode('utf-8')).decode('utf-8')
-        im_rec['image_data'], im_rec['image_shape'] = generate_image(ASSETS_FOLDER_PATH, image_format='png')
+        image_data, im_rec['image_shape'], im_rec['digest'] = \
+            generate_raw_image(ASSETS_FOLDER_PATH, image_format='png', rng=rng)
+        im_rec['image_data'] = [image_data]
         im_rec['filename'] = 'image.png'
         return im_rec
 
@@ -119,20 +224,23 @@ def generate_post_image_request(capsule, emb_strategy=None):
         # png image, capsule in the data
         im_rec['content_type'] = 'image/png'
         try:
-            if coin_flip():
-                im_rec['about'] = generate_bio()
-            im_rec['image_data'], im_rec['image_shape'] = \
-                generate_image(ASSETS_FOLDER_PATH, image_format='png', raw_data=False)
-            im_rec['image_data'] = image_array_to_raw(embed_lsb(im_rec['image_data'], capsule), image_format='png')
+            if coin_flip(rng):
+                im_rec['about'] = generate_bio(rng)
+            # N.B. a seeded run passes a seed drawn from its generator, so the image doesn't depend on the executor
+            im_rec['image_data'], im_rec['image_shape'] = await run_in_executor(
+                executor_for(__name__, 'push', PROFILE['push']['executor']), encode_capsule_image,
+                ASSETS_FOLDER_PATH, capsule, rng.getrandbits(64) if seeded(rng) else None)
         except Exception:
             # if failed to embed, switch to strategy png + about field
             im_rec['emb_strategy'] = 2  # N.B. emb_strategy must be set to 1
             im_rec['about'] = base64.b64encode(capsule.encode('utf-8')).decode('utf-8')
-            im_rec['image_data'], im_rec['image_shape'] = generate_image(ASSETS_FOLDER_PATH, image_format='png')
+            image_data, im_rec['image_shape'], im_rec['digest'] = \
+                generate_raw_image(ASSETS_FOLDER_PATH, image_format='png', rng=rng)
+            im_rec['image_data'] = [image_data]
         return im_rec
 
 
-def check_capsule(image_rec, image_raw_data, image_shape, emb_strategy, capsule):
+def check_capsule(image_rec, image_reader, image_shape, emb_strategy, capsule):
     if emb_strategy == 0:
         # capsule was not saved
         raise Exception("No capsule was not saved (strategy = 0)")
@@ -146,11 +254,11 @@ def check_capsule(image_rec, image_raw_data, image_shape, emb_strategy, capsule)
     else:
         # png image, capsule in the data
         # N.B. we consider any error that might occur here to result in CORRUPT state
-        image_array = image_raw_to_array(image_raw_data)
-        if image_array.shape != image_shape:
-            raise Exception('Incorrect image size: expected={0}, recv]{1}'.format(image_array.shape, image_shape))
+        # N.B. only the scanlines holding the capsule are decoded, the shape is taken from IHDR
+        capsule_recv, recv_shape = image_reader.result()
+        if recv_shape != image_shape:
+            raise Exception('Incorrect image size: expected={0}, recv={1}'.format(image_shape, recv_shape))
 
-        capsule_recv = extract_lsb(image_array)
         if capsule_recv != capsule:
             raise Exception('Retrieved capsule doesn\'t match the correct one: capsule="{0}", recv="{1}"'
                             .format(capsule, capsule_recv))
@@ -159,28 +267,28 @@ def check_capsule(image_rec, image_raw_data, image_shape, emb_strategy, capsule)
 # endregion Payload generation and capsule checking
 
 
-async def do_push(endpoint, capsule, _label, _metadata):
+async def do_push(endpoint, capsule, _label, metadata):
     # 1. preprocess the capsule
     capsule = decode_if_unicode(capsule)
-    checker_name, checker_pass = generate_user_name(), generate_user_pass()
+    rng = get_rng(metadata)
+    checker_name, checker_pass = generate_user_name(rng), generate_user_pass(rng)
 
-    async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True),
-                                     timeout=aiohttp.ClientTimeout(total=SESSION_TOTAL_TIMEOUT),
-                                     skip_auto_headers={'User-Agent'}) as session:
+    session, keep_session = new_session(), False
+    try:
         # 2. register a new user
         logger.info('[%s] on PUSH: registering user %s via POST /signup', endpoint, checker_name)
         try:
             # prepare POST request parameters
-            headers = {'User-Agent': get_random_user_agent()}
+            headers = {'User-Agent': get_random_user_agent(rng)}
             url = REGISTER_URI_FMT.format(endpoint=endpoint, port=PORT)
             data = {
                 'username': checker_name,
-                'first_name': generate_first_name(),
-                'last_name': generate_last_name(),
+                'first_name': generate_first_name(rng),
+                'last_name': generate_last_name(rng),
                 'password': checker_pass,
             }
-            if coin_flip():
-                data['about'] = generate_bio()
+            if coin_flip(rng):
+                data['about'] = generate_bio(rng)
 
             # make the request
             async with session.post(url, headers=headers, data=data) as r:
@@ -228,7 +336,10 @@ async def do_push(endpoint, capsule, _label, _metadata):
 
             # generate request data
             url = POST_IMAGE_URI_FMT.format(endpoint=endpoint, port=PORT)
-            datas, post_image_info, save_into_index = generate_post_image_requests(capsule)
+            emb_strategy = strategy_scheduler.choose(endpoint, getattr(metadata, 'round', None), rng)
+            datas, post_image_info, save_into_index = await generate_post_image_requests(capsule, emb_strategy, rng)
+            # N.B. the strategy actually used is recorded, strategy 3 falls back to 2 if the capsule doesn't fit
+            strategy_scheduler.commit(endpoint, post_image_info['emb_strategy'])
             logger.info('[%s] on PUSH: uploading %s images', endpoint, len(datas))
             logger.info('[%s] on PUSH: using strategy \"%s\" to save the capsule', endpoint,
                         post_image_info['emb_strategy'])
@@ -264,7 +375,7 @@ async def do_push(endpoint, capsule, _label, _metadata):
             return Result.MUMBLE, '', 'Failed to save a new image'
 
         # 4. get any of the images immediately (execute ~half the time)
-        random.shuffle(image_records)
+        rng.shuffle(image_records)
         for get_image_record in image_records:
             try:
                 get_image_id = get_image_record['id']
@@ -296,9 +407,11 @@ async def do_push(endpoint, capsule, _label, _metadata):
 
         logger.info('[%s] on PUSH: checked GETing the images info', endpoint)
 
-        # 5. logout (half the time)
+        # 5. logout (half the time), otherwise the session might be reused on PULL
         # N.B. any errors are just ignored - we don't care
-        if coin_flip():
+        keep_session = session_cache.enabled
+        if coin_flip(rng):
+            keep_session = False
             try:
                 async with session.get(LOGOUT_URI_FMT.format(endpoint=endpoint, port=PORT), headers=headers) as r:
                     if r.status != LOGOUT_RET_CODE_OK:
@@ -310,74 +423,106 @@ async def do_push(endpoint, capsule, _label, _metadata):
                 logger.error('[%s] on PUSH: Exception on /logout: %s', endpoint, ex)
                 logger.info('[%s] on PUSH:     ignoring', endpoint)
 
+    finally:
+        if keep_session:
+            await session_cache.put((endpoint, checker_name), session)
+        else:
+            await session.close()
+
     # 5. save the user's creds and the image id for PULLing
-    label = '{0}:{1}:{2}:{3}:{4}'.format(
-        checker_name, checker_pass, post_image_info['image_shape'], image_id, post_image_info['emb_strategy']
-    )
+    label = pack_label(checker_name, checker_pass, post_image_info['image_shape'], image_id,
+                       post_image_info['emb_strategy'])
     return Result.UP, label, 'UP'
 
 
-async def do_pull(endpoint, capsule, label, _metadata):
+async def login(session, endpoint, headers, checker_name, checker_pass):
+    logger.info('[%s] on PULL: logging in via POST at /login as user: %s:%s', endpoint, checker_name, checker_pass)
+    try:
+        url = LOGIN_URI_FMT.format(endpoint=endpoint, port=PORT)
+        data = {
+            'username': checker_name,
+            'password': checker_pass,
+        }
+        async with session.post(url, headers=headers, data=data) as r:
+            if r.status != LOGIN_RET_CODE_OK:
+                logger.info('[%s] on PULL: failed to login with %s:%s, status=%s', endpoint, checker_name,
+                            checker_pass, r.status)
+                return Result.MUMBLE, 'Failed to login'
+
+    except aiohttp.ClientResponseError as ex:
+        logger.error('[%s] on PULL: failed to proceed after server had responded: %s', endpoint, ex)
+        return Result.MUMBLE, 'Failed to login'
+    except aiohttp.ClientConnectionError as ex:
+        logger.error('[%s] on PULL: failed to establish connection: %s', endpoint, ex)
+        return Result.DOWN, 'Connection error on POST /login'
+    except Exception as ex:
+        logger.error('[%s] on PULL: Exception while logging in: %s', endpoint, ex)
+        return Result.DOWN, 'Connection error on POST /login'
+
+    return None
+
+
+async def do_pull(endpoint, capsule, label, metadata, connector=None):
     # 1. get the checker's user credentials and other saved data
     capsule = decode_if_unicode(capsule)
     label = decode_if_unicode(label)
-    v = label.split(':')
-    checker_name, checker_pass, image_shape, image_id, emb_strategy = v[0], v[1], v[2], v[3], v[4]
-    image_shape = tuple(map(int, image_shape.replace('(', '').replace(')', '').split(',')))
-    emb_strategy = int(emb_strategy)
-
-    async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True),
-                                     timeout=aiohttp.ClientTimeout(total=SESSION_TOTAL_TIMEOUT),
-                                     skip_auto_headers={'User-Agent'}) as session:
-        # 2. login as the user
-        logger.info('[%s] on PULL: logging in via POST at /login as user: %s:%s', endpoint, checker_name, checker_pass)
-        try:
-            headers = {'User-Agent': get_random_user_agent()}
-            url = LOGIN_URI_FMT.format(endpoint=endpoint, port=PORT)
-            data = {
-                'username': checker_name,
-                'password': checker_pass,
-            }
-            async with session.post(url, headers=headers, data=data) as r:
-                if r.status != LOGIN_RET_CODE_OK:
-                    logger.info('[%s] on PULL: failed to login with %s:%s, status=%s', endpoint, checker_name,
-                                checker_pass, r.status)
-                    return Result.MUMBLE, 'Failed to login'
-
-        except aiohttp.ClientResponseError as ex:
-            logger.error('[%s] on PULL: failed to proceed after server had responded: %s', endpoint, ex)
-            return Result.MUMBLE, 'Failed to login'
-        except aiohttp.ClientConnectionError as ex:
-            logger.error('[%s] on PULL: failed to establish connection: %s', endpoint, ex)
-            return Result.DOWN, 'Connection error on POST /login'
-        except Exception as ex:
-            logger.error('[%s] on PULL: Exception while logging in: %s', endpoint, ex)
-            return Result.DOWN, 'Connection error on POST /login'
+    checker_name, checker_pass, image_shape, image_id, emb_strategy = unpack_label(label)
+
+    headers = {'User-Agent': get_random_user_agent(get_rng(metadata))}
+    # N.B. time spent decoding the capsule, it's the strategy's cost of a PULL
+    decode_time = 0.0
+    session = await session_cache.get((endpoint, checker_name))
+    cached, keep_session = session is not None, False
+    if not cached:
+        session = new_session(connector)
+    try:
+        # 2. login as the user (unless the session authenticated on PUSH is cached)
+        if cached:
+            logger.info('[%s] on PULL: reusing the cached session of user %s', endpoint, checker_name)
+        else:
+            error = await login(session, endpoint, headers, checker_name, checker_pass)
+            if error is not None:
+                return error
 
         # 3. get the image info
-        try:
-            logger.info('[%s] on PULL: GETing the image via GET at /image/%s', endpoint, image_id)
-            url = GET_IMAGE_URI_FMT.format(endpoint=endpoint, port=PORT, image_id=image_id)
-            async with session.get(url, headers=headers) as r:
-                if r.status != GET_IMAGE_RET_CODE_OK:
-                    logger.info('[%s] on PULL: received code=%s', endpoint, r.status)
-                    return Result.MUMBLE, 'Failed to fetch the image info'
-                image_rec = await r.json()
-                if 'url' not in image_rec:
-                    logger.info('[%s] on PULL: response doesn\'t contain the contents url', endpoint)
-                    return Result.MUMBLE, 'Failed to fetch the image info'
-                image_contents_url = image_rec['url'] or ''
+        # N.B. if the cached session has expired on the server side, the user logs in again
+        check_expired = cached
+        while True:
+            try:
+                logger.info('[%s] on PULL: GETing the image via GET at /image/%s', endpoint, image_id)
+                url = GET_IMAGE_URI_FMT.format(endpoint=endpoint, port=PORT, image_id=image_id)
+                async with session.get(url, headers=headers) as r:
+                    expired = check_expired and (r.status == GET_IMAGE_RET_CODE_UNAUTHORIZED or len(r.history) > 0)
+                    if not expired:
+                        if r.status != GET_IMAGE_RET_CODE_OK:
+                            logger.info('[%s] on PULL: received code=%s', endpoint, r.status)
+                            return Result.MUMBLE, 'Failed to fetch the image info'
+                        image_rec = await r.json()
+                        if 'url' not in image_rec:
+                            logger.info('[%s] on PULL: response doesn\'t contain the contents url', endpoint)
+                            return Result.MUMBLE, 'Failed to fetch the image info'
+                        image_contents_url = image_rec['url'] or ''
 
-        except aiohttp.ClientResponseError as ex:
-            logger.error('[%s] on PULL: failed to proceed after server had responded: %s', endpoint, ex)
-            return Result.MUMBLE, 'Failed to fetch the image info'
-        except aiohttp.ClientConnectionError as ex:
-            logger.error('[%s] on PULL: surprisingly failed to connect (after successful /login): %s', endpoint, ex)
-            logger.info('[%s] on PULL: returning MUMBLE since the first part was a success', endpoint)
-            return Result.MUMBLE, 'Connection error on GET /image/{id}'
-        except Exception as ex:
-            logger.error('[%s] on PULL: Exception while querying /image/{id}: %s', endpoint, ex)
-            return Result.MUMBLE, 'Failed to fetch the image info'
+            except aiohttp.ClientResponseError as ex:
+                logger.error('[%s] on PULL: failed to proceed after server had responded: %s', endpoint, ex)
+                return Result.MUMBLE, 'Failed to fetch the image info'
+            except aiohttp.ClientConnectionError as ex:
+                logger.error('[%s] on PULL: surprisingly failed to connect (after successful /login): %s',
+                             endpoint, ex)
+                logger.info('[%s] on PULL: returning MUMBLE since the first part was a success', endpoint)
+                return Result.MUMBLE, 'Connection error on GET /image/{id}'
+            except Exception as ex:
+                logger.error('[%s] on PULL: Exception while querying /image/{id}: %s', endpoint, ex)
+                return Result.MUMBLE, 'Failed to fetch the image info'
+
+            if not expired:
+                break
+            logger.info('[%s] on PULL: the cached session has expired, logging in again', endpoint)
+            check_expired = False
+            session.cookie_jar.clear()
+            error = await login(session, endpoint, headers, checker_name, checker_pass)
+            if error is not None:
+                return error
 
         # 4. fetch the image contents (raw data of .jpg or .png) via the link
         try:
@@ -388,7 +533,15 @@ async def do_pull(endpoint, capsule, label, _metadata):
                 if r.status != DOWNLOAD_IMAGE_RET_CODE_OK:
                     logger.info('[%s] on PULL: received code: %s', endpoint, r.status)
                     return Result.MUMBLE, 'Failed to download the image'
-                image_raw_data = await r.read()
+                # N.B. the image is checked while it's being downloaded, the rest of it is not read at all
+                image_reader = PngLsbReader() if emb_strategy == 3 else None
+                async for chunk in iter_body(r, MAX_IMAGE_SIZE):
+                    if image_reader is not None:
+                        started = time.perf_counter()
+                        image_reader.feed(chunk)
+                        decode_time += time.perf_counter() - started
+                        if image_reader.done:
+                            break
 
         except aiohttp.ClientResponseError as ex:
             logger.error('[%s] on PULL: failed to proceed after server had responded: %s', endpoint, ex)
@@ -401,13 +554,24 @@ async def do_pull(endpoint, capsule, label, _metadata):
             logger.error('[%s] on PULL: Exception while querying image contests: %s', endpoint, ex)
             return Result.MUMBLE, 'Failed to download the image'
 
+        keep_session = session_cache.enabled
+
+    finally:
+        # N.B. a session that failed a request is not reused
+        if keep_session:
+            await session_cache.put((endpoint, checker_name), session)
+        else:
+            await session.close()
+
     # 5. extract the LSB-embedded message and check it
     # N.B. we finished the session to check the flag without time restrictions (imposed by SESSION_TIMEOUT)
     try:
-        check_capsule(image_rec, image_raw_data, image_shape, emb_strategy, capsule)
+        started = time.perf_counter()
+        check_capsule(image_rec, image_reader, image_shape, emb_strategy, capsule)
     except Exception as ex:
         logger.error('[%s] on PULL: Exception while checking the retrieved image: %s', endpoint, ex)
         return Result.CORRUPT, 'Incorrect flag'
+    strategy_scheduler.observe(emb_strategy, 'pull', decode_time + time.perf_counter() - started)
 
     return Result.UP, 'UP'
 
@@ -423,9 +587,9 @@ async def push(endpoint, capsule, label, metadata):
         return Result.MUMBLE, '', 'Incorrect server response'
 
 
-async def pull(endpoint, capsule, label, metadata):
+async def pull(endpoint, capsule, label, metadata, connector=None):
     try:
-        return await do_pull(endpoint, capsule, label, metadata)
+        return await do_pull(endpoint, capsule, label, metadata, connector)
     except Exception as ex:
         # N.B. PARANOIA MODE ON!!! JAVA STYLE PROGRAMMING MODE ON!!!
         #      sim.
@@ -433,6 +597,24 @@ async def pull(endpoint, capsule, label, metadata):
         return Result.MUMBLE, 'Incorrect server response'
 
 
+async def pull_many(endpoint, items, concurrency):
+    # N.B. every flag has a user of its own, so the logins can't be shared, but the new sessions of the batch share
+    #      the team's few kept-alive connections instead of connecting per flag. The connector outlives the batch,
+    #      so the sessions are cached for the next PULLs of their users (the cached ones are used as they are)
+    connector = batch_connectors.get(endpoint)
+    if connector is None or connector.closed:
+        connector = batch_connectors[endpoint] = aiohttp.TCPConnector(limit=PULL_BATCH_CONNECTIONS)
+    return await run_batch((pull(endpoint, capsule, label, metadata, connector) for capsule, label, metadata in items),
+                           concurrency)
+
+
+async def shutdown():
+    await session_cache.close()
+    while batch_connectors:
+        _, connector = batch_connectors.popitem()
+        await connector.close()
+
+
 # region Tests
 
 
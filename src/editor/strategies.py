@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import collections
+
+from common.seeding import seeded
+
+# N.B. the capsule embedding strategies: 1 - JPEG + about field, 2 - PNG + about field, 3 - PNG + LSB
+#      (the decoy images use strategy 0 and carry no capsule)
+STRATEGIES = (1, 2, 3)
+# N.B. weight of the latest measurement in a strategy's moving average cost
+COST_ALPHA = 0.2
+
+
+class StrategyScheduler(object):
+    # Picks the embedding strategy of a PUSH, balancing the coverage of the strategies against the CPU spent:
+    #   - every strategy is used at least once per `window` PUSHes to a team: once a strategy is due, the least
+    #     recently used one is forced (the first PUSHes to a team go round-robin),
+    #   - otherwise a strategy is drawn uniformly, unless its expected cost doesn't fit into what's left of
+    #     the round's `budget` (seconds, 0 - unlimited): the cheapest strategy is used then.
+    #   The expected cost of a strategy is the moving average time of its PUSH plus that of its PULL times the
+    #   PULLs per PUSH, charged to the round of the PUSH.
+    #   N.B. the time of the image encoding includes waiting for a process pool worker, so it grows with the load
+    #   N.B. a seeded run ignores the budget, so that its workload doesn't depend on the timings
+    def __init__(self, window, budget):
+        self.window = max(window, len(STRATEGIES))
+        self.budget = budget
+        self.costs = {}
+        self.counts = collections.Counter()
+        self._history = {}
+        self._round = None
+        self._spent = 0.0
+
+    def cost(self, strategy):
+        # N.B. a strategy not measured yet is assumed free, so that it gets measured
+        push_cost = self.costs.get((strategy, 'push'), 0.0)
+        pull_cost = self.costs.get((strategy, 'pull'), 0.0)
+        return push_cost + pull_cost * self.counts[(strategy, 'pull')] / max(self.counts[(strategy, 'push')], 1)
+
+    def observe(self, strategy, operation, elapsed):
+        key = (strategy, operation)
+        self.costs[key] = elapsed if key not in self.costs else \
+            COST_ALPHA * elapsed + (1 - COST_ALPHA) * self.costs[key]
+        self.counts[key] += 1
+
+    def choose(self, team, round_number, rng):
+        # Proposes the strategy of a PUSH, `commit` records the one actually used
+        #   team: any key of the team (its endpoint); round_number may be None if unknown (no budget then)
+        n_pushes, last_used = self._history.get(team, (0, {}))
+
+        if round_number is not None and round_number != self._round:
+            self._round, self._spent = round_number, 0.0
+
+        due = [s for s in STRATEGIES if n_pushes - last_used.get(s, -self.window) >= self.window]
+        if due:
+            oldest = min(last_used.get(s, -self.window) for s in due)
+            strategy = rng.choice([s for s in due if last_used.get(s, -self.window) == oldest])
+        else:
+            strategy = rng.choice(STRATEGIES)
+            if self.budget > 0 and round_number is not None and not seeded(rng) and \
+                    self._spent + self.cost(strategy) > self.budget:
+                strategy = min(STRATEGIES, key=self.cost)
+        return strategy
+
+    def commit(self, team, strategy):
+        # N.B. the strategy used may differ from the proposed one (a fallback), only the used one is covered
+        n_pushes, last_used = self._history.get(team, (0, {}))
+        last_used[strategy] = n_pushes
+        self._history[team] = (n_pushes + 1, last_used)
+        self._spent += self.cost(strategy)
+
+
+# region Tests
+
+
+def fallback_does_not_cover_the_proposed_strategy():
+    import random
+    scheduler = StrategyScheduler(window=3, budget=0)
+    rng = random.Random(0)
+    # the first PUSHes go round-robin, strategy 3 is proposed once but falls back to 2
+    for _ in range(3):
+        strategy = scheduler.choose('team', 1, rng)
+        scheduler.commit('team', 2 if strategy == 3 else strategy)
+    _, last_used = scheduler._history['team']
+    assert 3 not in last_used, last_used
+    # strategy 3 has never been used, so it's the oldest due one
+    assert scheduler.choose('team', 1, rng) == 3
+
+
+if __name__ == '__main__':
+    fallback_does_not_cover_the_proposed_strategy()
+
+# endregion Tests
@@ -1,38 +1,63 @@
 # -*- coding: utf-8 -*-
-import numpy as np
 import glob
+import hashlib
 import io
+import mmap
 import os
 import random
-import secrets
+import struct
+import threading
+import zlib
 from string import ascii_lowercase, ascii_uppercase, ascii_letters, digits
-from uuid import uuid4
 
-from faker import Faker
-from skimage.io import imread, imsave
 from unidecode import unidecode
 
-fake = Faker()
+from common.profiles import profiles
+from common.seeding import random_hex, secure_choice, seeded
+
+PNG_COMPRESSION_LEVEL = int(os.getenv('EDITOR_PNG_COMPRESSION_LEVEL', 1))
+PNG_FILTER = os.getenv('EDITOR_PNG_FILTER', 'up')
+ASSET_CACHE_SIZE = int(os.getenv('EDITOR_ASSET_CACHE_SIZE', 64 * 1024 * 1024))
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_IDAT_SIZE = 1 << 18
+PNG_FILTERS = {'none': 0, 'sub': 1, 'up': 2}
+PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}  # number of channels -> PNG color type
+
+if PNG_FILTER not in PNG_FILTERS:
+    raise ValueError('Incorrect EDITOR_PNG_FILTER: {0} (expected one of: {1})'.format(
+        PNG_FILTER, ', '.join(PNG_FILTERS)))
+
+# N.B. Faker, numpy and scikit-image are heavy to import, so they are loaded on first use
+_fake = None
+
+
+def get_fake():
+    global _fake
+    if _fake is None:
+        from faker import Faker
+        _fake = Faker()
+    return _fake
 
 
 def decode_if_unicode(s):
     return unidecode(s)
 
 
-def coin_flip():
-    return random.randrange(0, 2) == 1
+def coin_flip(rng=random):
+    return rng.randrange(0, 2) == 1
 
 
-def get_random_user_agent():
-    return fake.user_agent()
+def get_random_user_agent(rng=random):
+    return profiles.user_agent(rng)
 
 
-def generate_user_name():
-    return uuid4().hex[:random.randrange(16, 22)]
+def generate_user_name(rng=random):
+    return random_hex(rng, rng.randrange(16, 22))
 
 
-def generate_user_pass():
-    length = random.randrange(12, 20)
+def generate_user_pass(rng=random):
+    length = rng.randrange(12, 20)
     special = '!"#$%&\'()*+,-./;<=>?@[\\]^_`{|}~'
     alphabet = ascii_letters + digits
     requirements = [
@@ -42,67 +67,254 @@ def generate_user_pass():
         special,  # at least one special symbol
         *(length - 4) * [alphabet]  # rest: letters digits and symbols
     ]
-    return ''.join(secrets.choice(req) for req in random.sample(requirements, length))
+    return ''.join(secure_choice(rng, req) for req in rng.sample(requirements, length))
 
 
-def generate_first_name():
-    return fake.first_name()
+def generate_first_name(rng=random):
+    return profiles.first_name(rng)
 
 
-def generate_last_name():
-    return fake.last_name()
+def generate_last_name(rng=random):
+    return profiles.last_name(rng)
 
 
-def generate_bio():
-    return fake.sentence(nb_words=random.randrange(5, 20))
+def generate_bio(rng=random):
+    return profiles.bio(rng)
 
 
-def generate_image_name():
-    return uuid4().hex[:random.randrange(12, 20)]
+def generate_image_name(rng=random):
+    return random_hex(rng, rng.randrange(12, 20))
 
 
 def image_raw_to_array(image_raw_data):
+    from skimage.io import imread
     return imread(io.BytesIO(image_raw_data))
 
 
 def image_array_to_raw(image_array, image_format):
-    buf = io.BytesIO()
-    imsave(buf, image_array, format=image_format)
-    buf.seek(0, 0)
-    return buf.read()
+    parts = image_array_to_parts(image_array, image_format)
+    return parts[0] if len(parts) == 1 else b''.join(parts)
+
 
+def image_array_to_parts(image_array, image_format):
+    # N.B. the encoded image as a list of parts to be written one by one (never joined into a single buffer)
+    if image_format == 'png':
+        parts = encode_png_parts(image_array)
+        if parts is not None:
+            return parts
 
-def generate_fake_image(img_fmt, raw_data):
-    img_fmt = img_fmt if img_fmt != 'jpg' else 'jpeg'
-    width = random.randrange(512, 1024)
-    height = random.randrange(512, 1024)
-    image_data = fake.image(size=(width, height), image_format=img_fmt)
+    from skimage.io import imsave
+    buf = io.BytesIO()
+    imsave(buf, image_array, format=image_format)
+    # N.B. the parts are returned from the process pool, a view of the buffer (getbuffer) can't be pickled
+    return [buf.getvalue()]
+
+
+def png_chunk(chunk_type, pieces):
+    # N.B. the chunk's data is given as pieces (e.g. the compressor's outputs), they are written (or joined) by
+    #      the caller along with the chunk's header and CRC and never copied here
+    crc = zlib.crc32(chunk_type)
+    for piece in pieces:
+        crc = zlib.crc32(piece, crc)
+    return [struct.pack('>I', sum(len(piece) for piece in pieces)) + chunk_type, *pieces, struct.pack('>I', crc)]
+
+
+def encode_png(image_array, compression_level=PNG_COMPRESSION_LEVEL, png_filter=PNG_FILTER):
+    # N.B. returns None if the image can't be encoded by the fast path (e.g. 16-bit), the caller falls back to imsave
+    parts = encode_png_parts(image_array, compression_level, png_filter)
+    return b''.join(parts) if parts is not None else None
+
+
+def encode_png_parts(image_array, compression_level=PNG_COMPRESSION_LEVEL, png_filter=PNG_FILTER):
+    # N.B. the image data is compressed by blocks of rows and split into several IDAT chunks of about
+    #      PNG_IDAT_SIZE bytes, so no buffer of the whole compressed image is ever allocated
+    import numpy as np
+
+    if image_array.dtype != np.uint8 or image_array.ndim not in (2, 3):
+        return None
+    height, width = image_array.shape[:2]
+    channels = 1 if image_array.ndim == 2 else image_array.shape[2]
+    if channels not in PNG_COLOR_TYPES:
+        return None
+
+    # 1. filter the scanlines, every one of them is prepended with the filter type byte
+    rows = np.ascontiguousarray(image_array).reshape(height, width * channels)
+    scanlines = np.empty((height, width * channels + 1), dtype=np.uint8)
+    scanlines[:, 0] = PNG_FILTERS[png_filter]
+    if png_filter == 'sub':
+        scanlines[:, 1:channels + 1] = rows[:, :channels]
+        np.subtract(rows[:, channels:], rows[:, :-channels], out=scanlines[:, channels + 1:])
+    elif png_filter == 'up':
+        scanlines[0, 1:] = rows[0]
+        np.subtract(rows[1:], rows[:-1], out=scanlines[1:, 1:])
+    else:
+        scanlines[:, 1:] = rows
+
+    # 2. compress and pack the chunks
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, PNG_COLOR_TYPES[channels], 0, 0, 0)
+    parts = [PNG_SIGNATURE, *png_chunk(b'IHDR', [ihdr])]
+    compressor = zlib.compressobj(compression_level)
+    rows_per_block = max(1, PNG_IDAT_SIZE // scanlines.shape[1])
+    pending, pending_size = [], 0
+    for start in range(0, height, rows_per_block):
+        data = compressor.compress(scanlines[start:start + rows_per_block])
+        if data:
+            pending.append(data)
+            pending_size += len(data)
+        if pending_size >= PNG_IDAT_SIZE:
+            parts.extend(png_chunk(b'IDAT', pending))
+            pending, pending_size = [], 0
+    pending.append(compressor.flush())
+    parts.extend(png_chunk(b'IDAT', pending))
+    parts.extend(png_chunk(b'IEND', []))
+    return parts
+
+
+def synthesize_image(width, height, rng=random):
+    # N.B. a gradient background with a few rectangles and ellipses on it plus some noise,
+    #      generated right into an array (no encode/decode round trip)
+    import numpy as np
+
+    rng = np.random.default_rng(rng.getrandbits(64))
+
+    # 1. linear gradient between two random colors along a random direction, it's separable:
+    #    color(y, x) = c0 + (c1 - c0) * (a * x + b * y) / span = row_term(y) + column_term(x)
+    angle = rng.uniform(0, 2 * np.pi)
+    a, b = np.cos(angle), np.sin(angle)
+    span = max(abs(a) * (width - 1) + abs(b) * (height - 1), 1)
+    c0, c1 = rng.integers(0, 256, size=(2, 3))
+    xs = (np.arange(width) * a - min(a, 0) * (width - 1)) / span
+    ys = (np.arange(height) * b - min(b, 0) * (height - 1)) / span
+    column_term = np.rint(c0 + xs[:, np.newaxis] * (c1 - c0)).astype(np.int16)
+    row_term = np.rint(ys[:, np.newaxis] * (c1 - c0)).astype(np.int16)
+    image = row_term[:, np.newaxis, :] + column_term[np.newaxis, :, :]
+
+    # 2. shapes
+    y, x = np.ogrid[0:height, 0:width]
+    for _ in range(rng.integers(1, 6)):
+        x0, x1 = np.sort(rng.integers(0, width, size=2))
+        y0, y1 = np.sort(rng.integers(0, height, size=2))
+        color = rng.integers(0, 256, size=3)
+        if rng.integers(0, 2):
+            image[y0:y1 + 1, x0:x1 + 1] = color
+        else:
+            cy, cx, ry, rx = (y0 + y1) / 2, (x0 + x1) / 2, max((y1 - y0) / 2, 1), max((x1 - x0) / 2, 1)
+            sy, sx = slice(y0, y1 + 1), slice(x0, x1 + 1)
+            mask = ((y[sy] - cy) / ry) ** 2 + ((x[:, sx] - cx) / rx) ** 2 <= 1
+            image[sy, sx][mask] = color
+
+    # 3. noise (half the time)
+    if rng.integers(0, 2):
+        amplitude = int(rng.integers(1, 5))
+        noise = np.frombuffer(rng.bytes(image.size), dtype=np.uint8).reshape(image.shape) % (2 * amplitude + 1)
+        image += noise
+        image -= amplitude
+    np.clip(image, 0, 255, out=image)
+    return image.astype(np.uint8)
+
+
+def generate_fake_image(img_fmt, raw_data, rng=random):
+    # N.B. arrays (to embed a capsule into) are synthesized with numpy, while encoded images still come from
+    #      Faker: its flat single polygon images are encoded faster than the synthesized ones (see benchmarks)
+    width = rng.randrange(512, 1024)
+    height = rng.randrange(512, 1024)
     if raw_data:
-        return image_data, (width, height, 3)
+        if seeded(rng):
+            get_fake().seed_instance(rng.getrandbits(64))
+        image_data = get_fake().image(size=(width, height), image_format=img_fmt if img_fmt != 'jpg' else 'jpeg')
+        return image_data, (height, width, 3)
     else:
-        return image_raw_to_array(image_data), (height, width, 3)
+        image_array = synthesize_image(width, height, rng)
+        return image_array, image_array.shape
+
+
+class Asset(object):
+    __slots__ = ('path', 'shape', 'digest', 'data')
+
+    def __init__(self, path, shape, digest, data):
+        self.path = path
+        self.shape = shape
+        self.digest = digest
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class AssetCache(object):
+    # N.B. the bundled assets never change: their listings, shapes and content hashes are kept for good,
+    #      their bytes - while they fit into `max_size`, the rest is memory-mapped (and paged in by the OS
+    #      while being uploaded), so an upload never makes a private copy of an asset
+    def __init__(self, max_size=ASSET_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self._listings = {}
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def listing(self, assets_folder_path, image_format):
+        key = (assets_folder_path, image_format)
+        paths = self._listings.get(key)
+        if paths is None:
+            images_folder_path = os.path.join(assets_folder_path, image_format)
+            paths = self._listings[key] = sorted(glob.glob(os.path.join(images_folder_path,
+                                                                        '*.{}'.format(image_format))))
+        return paths
+
+    def load(self, path):
+        asset = self._assets.get(path)
+        if asset is not None:
+            return asset
+
+        from skimage.io import imread
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        shape = imread(path).shape
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if self.size + len(data) <= self.max_size:
+                self.size += len(data)
+                data = data[:]
+        return self._assets.setdefault(path, Asset(path, shape, digest, data))
+
+
+asset_cache = AssetCache()
+
+
+def generate_raw_image(assets_folder_path, image_format, rng=random):
+    # N.B. returns (image_data, image_shape, digest), the digest is None for a fake image
+    if coin_flip(rng):
+        return generate_fake_image(image_format, True, rng) + (None,)
+
+    try:
+        asset = asset_cache.load(rng.choice(asset_cache.listing(assets_folder_path, image_format)))
+        return asset.read(), asset.shape, asset.digest
+
+    except Exception:
+        return generate_fake_image(image_format, True, rng) + (None,)
+
 
+def generate_image(assets_folder_path, image_format, raw_data=True, rng=random):
+    from skimage.io import imread
+    if raw_data:
+        image_data, image_shape, _ = generate_raw_image(assets_folder_path, image_format, rng)
+        return image_data, image_shape
 
-def generate_image(assets_folder_path, image_format, raw_data=True):
-    if coin_flip():
-        return generate_fake_image(image_format, raw_data)
+    if coin_flip(rng):
+        return generate_fake_image(image_format, raw_data, rng)
 
     try:
-        images_folder_path = os.path.join(assets_folder_path, image_format)
-        image_file_path = random.choice(glob.glob(os.path.join(images_folder_path, '*.{}'.format(image_format))))
+        image_file_path = rng.choice(asset_cache.listing(assets_folder_path, image_format))
         image_array = imread(image_file_path)
-        image_shape = image_array.shape
-        if raw_data:
-            with open(image_file_path, 'rb') as f:
-                return f.read(), image_shape
-        else:
-            return image_array, image_shape
+        return image_array, image_array.shape
 
     except Exception:
-        return generate_fake_image(image_format, raw_data)
+        return generate_fake_image(image_format, raw_data, rng)
 
 
 def embed_lsb(image_array, capsule):
+    import numpy as np
+
     def access_bit(_data, _num):
         base = int(_num // 8)
         shift = int(_num % 8)
@@ -157,3 +369,190 @@ def extract_lsb(image_array):
     message_bytes = bytes([to_int(lsb[i:i + 8]) for i in range(32, 32 + 8 * message_length, 8)])
     capsule_recv = message_bytes.decode('utf-8')
     return capsule_recv
+
+
+def encode_capsule_image(assets_folder_path, capsule, seed=None):
+    # N.B. the CPU-bound part of the PUSH (image generation, embedding and encoding), may run in a worker
+    #      process: takes a seed instead of a generator and returns the encoded parts and the shape
+    rng = random if seed is None else random.Random(seed)
+    image_array, image_shape = generate_image(assets_folder_path, image_format='png', raw_data=False, rng=rng)
+    return image_array_to_parts(embed_lsb(image_array, capsule), image_format='png'), image_shape
+
+
+class PngLsbReader(object):
+    # Incremental LSB extractor: PNG bytes are fed as they arrive, the scanlines are inflated and unfiltered
+    #   only until the length header and the payload are recovered. Images the reader can't handle (not a PNG,
+    #   palette, non 8-bit or interlaced) are buffered as is and must be checked with `extract_lsb` instead.
+    INFLATE_STEP = 1 << 16
+
+    def __init__(self):
+        self.shape = None
+        self.capsule = None
+        self.error = None
+        self.fallback = False
+        self.buffered = bytearray()
+
+        self._pending = bytearray()
+        self._signature_checked = False
+        self._chunk_type = None
+        self._chunk_left = 0
+        self._inflate = zlib.decompressobj()
+        self._raw = bytearray()
+        self._bpp = self._row_length = self._lsb_bytes_length = 0
+        self._prev_row = None
+        self._bits = []
+        self._n_bits = 0
+        self._message_length = None
+
+    @property
+    def done(self):
+        return self.capsule is not None or self.error is not None
+
+    def feed(self, data):
+        # N.B. errors are kept until `result` is called, so they are told apart from the download errors
+        if self.done:
+            return
+        try:
+            self._feed(data)
+        except Exception as ex:
+            self.error = ex
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        if self.fallback:
+            image_array = image_raw_to_array(bytes(self.buffered))
+            return extract_lsb(image_array), image_array.shape
+        if self.capsule is None:
+            raise Exception('Image data is too short: the capsule was not recovered')
+        return self.capsule, self.shape
+
+    def _feed(self, data):
+        if self.fallback or self.shape is None:
+            self.buffered += data
+        if self.fallback:
+            return
+
+        # N.B. only a partially received chunk header (or IHDR) is kept between the calls
+        data = memoryview(bytes(self._pending) + bytes(data) if self._pending else data)
+        self._pending = bytearray()
+        offset = 0
+        while offset < len(data) and not self.done and not self.fallback:
+            available = len(data) - offset
+            if not self._signature_checked:
+                # 1. check the signature
+                if available < len(PNG_SIGNATURE):
+                    break
+                if data[offset:offset + len(PNG_SIGNATURE)] != PNG_SIGNATURE:
+                    self.fallback = True
+                    break
+                offset += len(PNG_SIGNATURE)
+                self._signature_checked = True
+
+            elif self._chunk_type is None:
+                # 2. parse the chunk header, the first chunk must be IHDR
+                if available < 8:
+                    break
+                chunk_length, self._chunk_type = struct.unpack_from('>I4s', data, offset)
+                self._chunk_left = chunk_length + 4  # N.B. plus CRC
+                offset += 8
+                if self.shape is None and self._chunk_type != b'IHDR':
+                    self.fallback = True
+
+            elif self._chunk_type == b'IHDR':
+                # 3. get the image shape from IHDR
+                if available < self._chunk_left:
+                    break
+                self._parse_ihdr(data[offset:offset + 13])
+                offset += self._chunk_left
+                self._chunk_type = None
+
+            else:
+                # 4. stream IDAT data into the decompressor, skip the other chunks and CRCs
+                n = min(available, self._chunk_left)
+                if self._chunk_type == b'IDAT':
+                    self._inflate_idat(data[offset:offset + min(n, self._chunk_left - 4)])
+                offset += n
+                self._chunk_left -= n
+                if self._chunk_left == 0:
+                    self._chunk_type = None
+
+        if not self.done and not self.fallback:
+            self._pending += data[offset:]
+
+    def _parse_ihdr(self, ihdr):
+        width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', ihdr)
+        channels = {v: k for k, v in PNG_COLOR_TYPES.items()}.get(color_type)
+        if channels is None or bit_depth != 8 or interlace != 0:
+            self.fallback = True
+            return
+        self.shape = (height, width) if channels == 1 else (height, width, channels)
+        self._bpp = channels
+        self._row_length = width * channels + 1
+        self._lsb_bytes_length = height * width * channels // 8
+        self.buffered = bytearray()
+
+    def _inflate_idat(self, data):
+        while len(data) > 0 and not self.done:
+            self._raw += self._inflate.decompress(data, self.INFLATE_STEP)
+            data = self._inflate.unconsumed_tail
+            while len(self._raw) >= self._row_length and not self.done:
+                self._add_row(self._unfilter(self._raw[:self._row_length]))
+                del self._raw[:self._row_length]
+
+    def _unfilter(self, scanline):
+        import numpy as np
+
+        filter_type, raw = scanline[0], np.frombuffer(bytes(scanline[1:]), dtype=np.uint8)
+        prev = self._prev_row if self._prev_row is not None else np.zeros_like(raw)
+        bpp = self._bpp
+        if filter_type == 0:
+            row = raw
+        elif filter_type == 1:
+            row = np.cumsum(raw.reshape(-1, bpp), axis=0, dtype=np.uint8).reshape(-1)
+        elif filter_type == 2:
+            row = raw + prev
+        elif filter_type in (3, 4):
+            # N.B. average and paeth depend on the previously decoded byte, these are decoded byte by byte
+            row, up = bytearray(raw.tobytes()), prev.tobytes()
+            for i in range(len(row)):
+                left = row[i - bpp] if i >= bpp else 0
+                if filter_type == 3:
+                    row[i] = (row[i] + ((left + up[i]) >> 1)) & 0xff
+                else:
+                    up_left = up[i - bpp] if i >= bpp else 0
+                    p = left + up[i] - up_left
+                    pa, pb, pc = abs(p - left), abs(p - up[i]), abs(p - up_left)
+                    predictor = left if pa <= pb and pa <= pc else up[i] if pb <= pc else up_left
+                    row[i] = (row[i] + predictor) & 0xff
+            row = np.frombuffer(bytes(row), dtype=np.uint8)
+        else:
+            raise Exception('Unknown PNG filter type: {0}'.format(filter_type))
+        self._prev_row = row
+        return row
+
+    def _add_row(self, row):
+        import numpy as np
+
+        self._bits.append(row & 0x1)
+        self._n_bits += len(row)
+        if self._message_length is None and self._n_bits >= 32:
+            # 1. unpack message length
+            bits = np.concatenate(self._bits)
+            message_length = int.from_bytes(np.packbits(bits[:32], bitorder='little').tobytes(),
+                                            byteorder='little', signed=True)
+            if not 0 < message_length < self._lsb_bytes_length:
+                raise Exception('Incorrect packed message_length: expected 0 < message_length < {0}, but recv={1}'
+                                .format(self._lsb_bytes_length, message_length))
+            self._message_length = message_length
+        if self._message_length is not None and self._n_bits >= 32 + 8 * self._message_length:
+            # 2. extract the embedded message
+            bits = np.concatenate(self._bits)[32:32 + 8 * self._message_length]
+            self.capsule = np.packbits(bits, bitorder='little').tobytes().decode('utf-8')
+            self._bits = []
+
+
+def extract_lsb_from_png(image_raw_data):
+    reader = PngLsbReader()
+    reader.feed(image_raw_data)
+    return reader.result()
@@ -2,15 +2,18 @@
 import logging
 import os
 import sqlite3
-from uuid import uuid4
 
 import aiohttp
-from faker import Faker
 from unidecode import unidecode
 from volgactf.final.checker.result import Result
 
+from common.batches import run_batch
+from common.executors import EXECUTOR_LOOP
+from common.profiles import profiles
+from common.seeding import get_rng, random_hex, seeded
+from common.trace import trace_configs
+
 logger = logging.getLogger(__name__)
-fake = Faker()
 
 # region Environment variables
 
@@ -29,6 +32,13 @@ PULL_CAPSULE_URI_FMT = os.getenv('PULL_CAPSULE_URI_FMT', 'http://{endpoint}:{por
 
 # endregion Environment variables
 
+# N.B. resource profile of the operations, read by the simulator (see simulator/registry.py): a couple of short
+#      HTTP requests each, the sample is picked from a local SQLite database
+PROFILE = {
+    'push': {'cpu_heavy': False, 'io_bound': True, 'max_concurrency': 16, 'executor': EXECUTOR_LOOP},
+    'pull': {'cpu_heavy': False, 'io_bound': True, 'max_concurrency': 16, 'executor': EXECUTOR_LOOP},
+}
+
 
 # region Utils
 
@@ -43,35 +53,51 @@ def decode_if_unicode(*args):
         return [unidecode(s) if s is not None else None for s in args]
 
 
-def get_random_user_agent():
-    return fake.user_agent()
+def get_random_user_agent(rng):
+    return profiles.user_agent(rng)
+
+
+def select_sample(conn, rng):
+    c = conn.cursor()
+    if not seeded(rng):
+        c.execute('SELECT * FROM samples ORDER BY RANDOM() LIMIT 1')
+        return c.fetchone()
+    # N.B. SQLite's RANDOM() can't be seeded, so a seeded run picks the row by offset
+    c.execute('SELECT COUNT(*) FROM samples')
+    n_samples, = c.fetchone()
+    c.execute('SELECT * FROM samples LIMIT 1 OFFSET ?', (rng.randrange(n_samples),))
+    return c.fetchone()
+
+
+def new_session():
+    return aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True),
+                                 timeout=aiohttp.ClientTimeout(total=CONNECTION_TOTAL_TIMEOUT),
+                                 skip_auto_headers={'User-Agent'},
+                                 trace_configs=trace_configs('jinnice'))
 
 
 # endregion Utils
 
 
-async def do_push(endpoint, capsule, _label, _metadata):
+async def do_push(endpoint, capsule, _label, metadata):
     # 1. preprocess the capsule
     capsule = decode_if_unicode(capsule)
+    rng = get_rng(metadata)
 
-    async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True),
-                                     timeout=aiohttp.ClientTimeout(total=CONNECTION_TOTAL_TIMEOUT),
-                                     skip_auto_headers={'User-Agent'}) as session:
+    async with new_session() as session:
 
         # 2. POST the next task and get result
         logger.info('[%s] on PUSH: sending the next task via POST /task', endpoint)
         try:
             # select a task and generate a unique id
             with sqlite3.connect(SAMPLES_DB_PATH) as conn:
-                c = conn.cursor()
-                c.execute('SELECT * FROM samples ORDER BY RANDOM() LIMIT 1')
-                task_content, task_result, task_comments = c.fetchone()
+                task_content, task_result, task_comments = select_sample(conn, rng)
 
             task_content, task_result, task_comments = decode_if_unicode(task_content, task_result, task_comments)
-            task_id = uuid4().hex
+            task_id = random_hex(rng)
 
             # make the request
-            headers = {'User-Agent': get_random_user_agent()}
+            headers = {'User-Agent': get_random_user_agent(rng)}
             url = PUSH_TASK_URI_FMT.format(endpoint=endpoint, port=PORT)
             data = {'id': task_id, 'data': task_content}
             if task_comments is not None and task_comments != '':
@@ -132,44 +158,46 @@ async def do_push(endpoint, capsule, _label, _metadata):
     return Result.UP, task_id, 'UP'
 
 
-async def do_pull(endpoint, capsule, label, _metadata):
+async def do_pull(endpoint, capsule, label, metadata, session=None):
+    # N.B. the PULLs of a batch share the session (see pull_many)
+    if session is None:
+        async with new_session() as session:
+            return await do_pull(endpoint, capsule, label, metadata, session)
+
     # 1. get the task id
     capsule = decode_if_unicode(capsule)
     task_id = decode_if_unicode(label)
 
-    async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True),
-                                     timeout=aiohttp.ClientTimeout(total=CONNECTION_TOTAL_TIMEOUT),
-                                     skip_auto_headers={'User-Agent'}) as session:
-        # 2. GET capsule by task id
-        logger.info('[%s] on PULL: GETing capsule by task_id=%s', endpoint, task_id)
-        try:
-            headers = {'User-Agent': get_random_user_agent()}
-            url = PULL_CAPSULE_URI_FMT.format(endpoint=endpoint, port=PORT, task_id=task_id)
-            async with session.get(url, headers=headers) as r:
-                if r.status != PULL_CAPSULE_RET_CODE_OK:
-                    logger.info('[%s] on PULL: failed to GET capsule, status=%s', endpoint, r.status)
-                    return Result.MUMBLE, 'Incorrect response code on GET /pull/{id}'
-                response_record = await r.json()
-                if 'data' not in response_record:
-                    return Result.MUMBLE, 'Incorrect response format on GET /pull/{id}'
-                response_capsule = response_record['data']
-
-        except aiohttp.ClientResponseError as ex:
-            logger.error('[%s] on PULL: failed to proceed after server had responded: %s', endpoint, ex)
-            return Result.MUMBLE, 'Incorrect response on GET /pull/{id}'
-        except aiohttp.ClientConnectionError as ex:
-            logger.error('[%s] on PULL: failed to establish connection: %s', endpoint, ex)
-            return Result.DOWN, 'Connection error on GET /pull/{id}'
-        except Exception as ex:
-            logger.error('[%s] on PULL: Exception while GETing capsule: %s', endpoint, ex)
-            return Result.DOWN, 'Connection error on GET /pull/{id}'
+    # 2. GET capsule by task id
+    logger.info('[%s] on PULL: GETing capsule by task_id=%s', endpoint, task_id)
+    try:
+        headers = {'User-Agent': get_random_user_agent(get_rng(metadata))}
+        url = PULL_CAPSULE_URI_FMT.format(endpoint=endpoint, port=PORT, task_id=task_id)
+        async with session.get(url, headers=headers) as r:
+            if r.status != PULL_CAPSULE_RET_CODE_OK:
+                logger.info('[%s] on PULL: failed to GET capsule, status=%s', endpoint, r.status)
+                return Result.MUMBLE, 'Incorrect response code on GET /pull/{id}'
+            response_record = await r.json()
+            if 'data' not in response_record:
+                return Result.MUMBLE, 'Incorrect response format on GET /pull/{id}'
+            response_capsule = response_record['data']
+
+    except aiohttp.ClientResponseError as ex:
+        logger.error('[%s] on PULL: failed to proceed after server had responded: %s', endpoint, ex)
+        return Result.MUMBLE, 'Incorrect response on GET /pull/{id}'
+    except aiohttp.ClientConnectionError as ex:
+        logger.error('[%s] on PULL: failed to establish connection: %s', endpoint, ex)
+        return Result.DOWN, 'Connection error on GET /pull/{id}'
+    except Exception as ex:
+        logger.error('[%s] on PULL: Exception while GETing capsule: %s', endpoint, ex)
+        return Result.DOWN, 'Connection error on GET /pull/{id}'
 
-        # 3. check the capsule
-        if response_capsule != capsule:
-            logger.info('[%s] on PULL: the received capsule is incorrect', endpoint)
-            logger.info('[%s] on PULL: received=%s', endpoint, response_capsule)
-            logger.info('[%s] on PULL: actual  =%s', endpoint, capsule)
-            return Result.CORRUPT, 'Incorrect flag'
+    # 3. check the capsule
+    if response_capsule != capsule:
+        logger.info('[%s] on PULL: the received capsule is incorrect', endpoint)
+        logger.info('[%s] on PULL: received=%s', endpoint, response_capsule)
+        logger.info('[%s] on PULL: actual  =%s', endpoint, capsule)
+        return Result.CORRUPT, 'Incorrect flag'
 
     return Result.UP, 'UP'
 
@@ -183,10 +211,17 @@ async def push(endpoint, capsule, label, metadata):
         return Result.MUMBLE, '', 'Incorrect server response'
 
 
-async def pull(endpoint, capsule, label, metadata):
+async def pull(endpoint, capsule, label, metadata, session=None):
     try:
-        return await do_pull(endpoint, capsule, label, metadata)
+        return await do_pull(endpoint, capsule, label, metadata, session)
     except Exception as ex:
         # N.B. PARANOIA MODE ON!!! JAVA STYLE PROGRAMMING MODE ON!!!
         logger.exception('[%s] on PULL: Exception while PULLing capsule: %s', endpoint, ex)
         return Result.MUMBLE, 'Incorrect server response'
+
+
+async def pull_many(endpoint, items, concurrency):
+    # N.B. the batch's PULLs run over one session, reusing its kept-alive connections
+    async with new_session() as session:
+        return await run_batch((pull(endpoint, capsule, label, metadata, session)
+                                for capsule, label, metadata in items), concurrency)
@@ -1,19 +1,27 @@
 # -*- coding: utf-8 -*-
+import time
+
+START_TIME = time.monotonic()
+
 import asyncio
-import hashlib
 import logging
 import os
 import random
 import string
-import uuid
-
-import jinnice.main as jinnice
-import editor.main as editor
-import aesthetic.main as aesthetic
-import myblog.main as myblog
 
 from volgactf.final.checker.result import Result
 
+from common import executors
+from common.executors import current_check
+from common.seeding import SEED, check_rng, get_rng, random_hex
+from common.trace import recorder
+from simulator.capacity import CapacityModel
+from simulator.lifecycle import Shutdown, close_checkers
+from simulator.profiler import SamplingProfiler
+from simulator.registry import load_checkers
+from simulator.stats import Stats
+from simulator.watchdog import LoopWatchdog
+
 # region Environment variables
 
 TEAM_IP = os.getenv('TEAM_IP', '0.0.0.0')
@@ -27,15 +35,49 @@ SKIP_MYBLOG = False if os.getenv('SKIP_MYBLOG') is None else True
 PULL_COUNT = int(os.getenv('PULL_COUNT', 5))
 PRINT_STATS_EVERY_N_ROUND = int(os.getenv('PRINT_STATS_EVERY_N_ROUND', 1))
 PRINT_STATS_SINGLE_COLUMN = False if os.getenv('PRINT_STATS_SINGLE_COLUMN') is None else True
+PRINT_STATS_FORMAT = os.getenv('PRINT_STATS_FORMAT', 'text')
+
+CAPACITY_TEAMS = int(os.getenv('CAPACITY_TEAMS', 1))
+CAPACITY_CONCURRENCY = int(os.getenv('CAPACITY_CONCURRENCY', 1))
+CAPACITY_AUTO_THROTTLE = False if os.getenv('CAPACITY_AUTO_THROTTLE') is None else True
+
+SCHEDULE_CONCURRENT = False if os.getenv('SCHEDULE_CONCURRENT') is None else True
+PULL_SEPARATELY = False if os.getenv('PULL_SEPARATELY') is None else True
+SHUTDOWN_DEADLINE = float(os.getenv('SHUTDOWN_DEADLINE', 10))
+WATCHDOG_THRESHOLD = os.getenv('WATCHDOG_THRESHOLD')
+
+PROFILER_PATH = os.getenv('PROFILER_PATH')
+PROFILER_EVERY_N_ROUND = int(os.getenv('PROFILER_EVERY_N_ROUND', 10))
+PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', 0.005))
+PROFILER_MAX_OVERHEAD = float(os.getenv('PROFILER_MAX_OVERHEAD', 0.02))
 
 
 # endregion Environment variables
 
+# region Services
+
+# N.B. checker modules are imported only if the service is enabled (editor alone pulls numpy and scikit-image),
+#      every module declares the resource profile of its operations (see simulator/registry.py)
+SERVICES = (
+    ('editor', 'editor.main', SKIP_EDITOR),
+    ('aesthetic', 'aesthetic.main', SKIP_AESTHETIC),
+    ('myblog', 'myblog.main', SKIP_MYBLOG),
+    ('jinnice', 'jinnice.main', SKIP_JINNICE),
+)
+
+
+def load_services():
+    return load_checkers(SERVICES)
+
+
+# endregion Services
+
 # region Themis imitator
 
 class Metadata(object):
-    def __init__(self, round_number):
+    def __init__(self, round_number, rng=None):
         self.round_number = round_number
+        self.rng = rng
 
     @property
     def round(self):
@@ -52,71 +94,46 @@ def add_flag_to_pool(pool_flag_labels, flag, flag_adj, pull_count=5):
         pool_flag_labels.append({'flag': flag, 'label': flag_adj})
 
 
-def gen_capsule():
+def gen_capsule(rng=random):
     chars = string.ascii_uppercase + string.ascii_lowercase + string.digits
     # cur_flag = '{0}='.format(hashlib.md5(uuid.uuid4().bytes).hexdigest())
     return 'VolgaCTF{{{0}.{1}.{2}}}'.format(
-        ''.join(random.choice(chars) for _ in range(301)),
-        ''.join(random.choice(chars) for _ in range(301)),
-        ''.join(random.choice(chars) for _ in range(301))
+        ''.join(rng.choice(chars) for _ in range(301)),
+        ''.join(rng.choice(chars) for _ in range(301)),
+        ''.join(rng.choice(chars) for _ in range(301))
     )
 
 
-def print_stats(services):
-    template = '''\
-  Service      **{name}**
-  Latest PUSH
-    status:    {push_status}
-    message:   {push_message}
-  Latest PULL
-    status:    {pull_status}
-    message:   {pull_message}
-
-  Statistics (PUSH){padding}    Statistics (PULL)
-    UP:      {push_up: <{n}}      UP:      {pull_up: <{n}}
-    MUMBLE:  {push_mumble: <{n}}      MUMBLE:  {pull_mumble: <{n}}
-    CORRUPT: {push_corrupt: <{n}}      CORRUPT: {pull_corrupt: <{n}}
-    DOWN:    {push_down: <{n}}      DOWN:    {pull_down: <{n}}
-    TOTAL:   {push_total: <{n}}      TOTAL:   {pull_total: <{n}}\
-'''
-    stats = []
-    for service_name, _, _, _, latest, push_stats, pull_stats in services:
-        n = max(6, *[len(s) for s in map(str, list(push_stats.values()) + list(pull_stats.values()))])
-        m = n - 6
-        s = template.format(
-            name=service_name,
-            push_status=latest['push']['status'],
-            push_message=latest['push']['message'],
-            pull_status=latest['pull']['status'],
-            pull_message=latest['pull']['message'],
-            push_up=push_stats[Result.UP],
-            padding=' ' * m,
-            push_mumble=push_stats[Result.MUMBLE],
-            push_corrupt=push_stats[Result.CORRUPT],
-            push_down=push_stats[Result.DOWN],
-            push_total=sum(push_stats.values()),
-            pull_up=pull_stats[Result.UP],
-            pull_mumble=pull_stats[Result.MUMBLE],
-            pull_corrupt=pull_stats[Result.CORRUPT],
-            pull_down=pull_stats[Result.DOWN],
-            pull_total=sum(pull_stats.values()),
-            n=n,
-        )
-        stats.append(s)
-
-    max_width = max([max([len(r) for r in s.split('\n')]) for s in stats])
-    border = '=' * max_width
-    if PRINT_STATS_SINGLE_COLUMN or len(stats) < 2:
-        for s in stats:
-            print('{0}\n{1}\n{0}'.format(border, s))
-    else:
-        for sl, sr in zip(stats[0::2], stats[1::2]):
-            print('{0:<{width}}{0:<{width}}'.format(border, width=max_width + 4))
-            for sll, srl in zip(sl.split('\n'), sr.split('\n')):
-                print('{0:<{width}}{1:<{width}}'.format(sll, srl, width=max_width + 4))
-            print('{0:<{width}}{0:<{width}}'.format(border, width=max_width + 4))
-        if len(stats) & 1:
-            print('{0}\n{1}\n{0}'.format(border, stats[-1]))
+def check_metadata(round_number, service_name, operation, index=0):
+    # N.B. a seeded run gives every check its own generator, so the workload doesn't depend on the order
+    #      (or the outcome) of the other checks
+    if SEED is None:
+        return Metadata(round_number)
+    return Metadata(round_number, rng=check_rng(SEED, round_number, service_name, operation, index))
+
+
+def print_stats(stats, capacity=None, watchdog=None):
+    if PRINT_STATS_FORMAT == 'csv':
+        print(stats.format_csv())
+        return
+    if PRINT_STATS_FORMAT == 'json':
+        print(stats.format_json())
+        return
+
+    print(stats.format_text(single_column=PRINT_STATS_SINGLE_COLUMN))
+    if capacity is not None:
+        for service_name in stats.service_names:
+            push_cost, pull_cost = (capacity.cost(service_name, op) for op in ('push', 'pull'))
+            print('  Cost of {0}: PUSH {1}, PULL {2}'.format(
+                service_name,
+                '-' if push_cost is None else '{0:.3f}s'.format(push_cost),
+                '-' if pull_cost is None else '{0:.3f}s'.format(pull_cost)))
+        projected = capacity.predict_round(stats.service_names, PULL_COUNT)
+        print('  Projected round: {0:.1f}s of {1}s for {2} team(s) at concurrency {3}{4}'.format(
+            projected, ROUND_DURATION, capacity.n_teams, capacity.concurrency,
+            ' - OVERRUN' if projected > ROUND_DURATION else ''))
+    if watchdog is not None and watchdog.blocks:
+        print(watchdog.format_summary())
 
 
 async def main(team_ip, timeout, debug=False):
@@ -133,65 +150,163 @@ async def main(team_ip, timeout, debug=False):
         logger.info('All the four services are skipped - nothing to do...')
         return
 
-    services = []
-    if not SKIP_EDITOR:
-        services.append(('editor', editor.push, editor.pull))
-    if not SKIP_AESTHETIC:
-        services.append(('aesthetic', aesthetic.push, aesthetic.pull))
-    if not SKIP_MYBLOG:
-        services.append(('myblog', myblog.push, myblog.pull))
-    if not SKIP_JINNICE:
-        services.append(('jinnice', jinnice.push, jinnice.pull))
-    services = [
-        (
-            service_name,
-            push_fn,
-            pull_fn,
-            [],
-            {'push': {'status': '', 'message': ''}, 'pull': {'status': '', 'message': ''}},
-            {r: 0 for r in Result},
-            {r: 0 for r in Result},
-        )
-        for service_name, push_fn, pull_fn in services
-    ]
+    checkers = load_services()
+    service_names = [checker.name for checker in checkers]
+    logger.info('Loaded services %s in %.3f sec since start', ', '.join(service_names), time.monotonic() - START_TIME)
+    for checker in checkers:
+        logger.info('  %s', checker.describe())
+    stats = Stats([team_ip], service_names)
+    capacity = CapacityModel(n_teams=CAPACITY_TEAMS, concurrency=CAPACITY_CONCURRENCY)
+    pools = {checker.name: [] for checker in checkers}
+    # N.B. every operation of a checker runs at most at its declared concurrency
+    limits = {
+        (checker.name, operation): asyncio.Semaphore(profile.max_concurrency if SCHEDULE_CONCURRENT else 1)
+        for checker in checkers for operation, profile in checker.profiles.items()
+    }
+
+    # N.B. reports the checker steps blocking the event loop longer than the threshold (see simulator/watchdog.py)
+    watchdog = None
+    if WATCHDOG_THRESHOLD is not None:
+        watchdog = LoopWatchdog(float(WATCHDOG_THRESHOLD), service_names)
+        watchdog.start()
+
+    # N.B. writes the CPU time sampled per service, operation and step every N rounds (see simulator/profiler.py)
+    profiler, profiled_from = None, 1
+    if PROFILER_PATH is not None:
+        profiler = SamplingProfiler(PROFILER_PATH, service_names, PROFILER_INTERVAL, PROFILER_MAX_OVERHEAD)
+        profiler.start()
+
+    # N.B. on SIGINT/SIGTERM no new checks are started, the ones in flight are drained (see simulator/lifecycle.py)
+    shutdown = Shutdown(SHUTDOWN_DEADLINE)
+    shutdown.install()
+
+    async def push(round_number, checker):
+        if shutdown.requested:
+            return
+        current_check.set((checker.name, 'push'))
+        md = check_metadata(round_number, checker.name, 'push')
+        rng = get_rng(md)
+        label = random_hex(rng, 16)
+        cur_flag = gen_capsule(rng)
+
+        logger.info('[%d]  %s: pushing flag %s', round_number, checker.name, cur_flag)
+        async with limits[(checker.name, 'push')]:
+            started = time.monotonic()
+            cur_res, label, message = await checker.push(team_ip, cur_flag, label, md)
+            if shutdown.cancelled:
+                return
+            elapsed = time.monotonic() - started
+            capacity.observe(checker.name, 'push', elapsed)
+        if round_number == 1:
+            logger.info('[%d]  First PUSH to %s finished %.3f sec since start', round_number, checker.name,
+                        time.monotonic() - START_TIME)
+        logger.info('[%d]  %s: status=%s, message="%s"', round_number, checker.name, cur_res, message)
+        stats.record(team_ip, checker.name, 'push', cur_res, message, round_number, elapsed)
+        if cur_res == Result.UP:
+            add_flag_to_pool(pools[checker.name], cur_flag, label, pull_count=PULL_COUNT)
+
+    async def pull(round_number, checker, i, flag_label):
+        if shutdown.requested:
+            return
+        current_check.set((checker.name, 'pull'))
+        cur_flag, label = flag_label['flag'], flag_label['label']
+        logger.info('[%d]  %s: pulling flag %s', round_number, checker.name, cur_flag)
+        md = check_metadata(round_number, checker.name, 'pull', i)
+        async with limits[(checker.name, 'pull')]:
+            started = time.monotonic()
+            cur_res, message = await checker.pull(team_ip, cur_flag, label, md)
+            if shutdown.cancelled:
+                return
+            elapsed = time.monotonic() - started
+            capacity.observe(checker.name, 'pull', elapsed)
+        logger.info('[%d]  %s: status=%s, message="%s"', round_number, checker.name, cur_res, message)
+        stats.record(team_ip, checker.name, 'pull', cur_res, message, round_number, elapsed)
+
+    async def pull_many(round_number, checker, indexed_flag_labels):
+        # indexed_flag_labels: [(pool index, flag label), ...], the index gives every PULL its own metadata
+        if shutdown.requested or not indexed_flag_labels:
+            return
+        current_check.set((checker.name, 'pull'))
+        flag_labels = [flag_label for _, flag_label in indexed_flag_labels]
+        for flag_label in flag_labels:
+            logger.info('[%d]  %s: pulling flag %s', round_number, checker.name, flag_label['flag'])
+        items = [(flag_label['flag'], flag_label['label'], check_metadata(round_number, checker.name, 'pull', i))
+                 for i, flag_label in indexed_flag_labels]
+        # N.B. the batch runs its PULLs at the same concurrency as separate PULLs would run, and times each of them
+        concurrency = checker.profiles['pull'].max_concurrency if SCHEDULE_CONCURRENT else 1
+        async with limits[(checker.name, 'pull')]:
+            results = await checker.pull_many(team_ip, items, concurrency)
+            if shutdown.cancelled:
+                return
+            for _, _, elapsed in results:
+                capacity.observe(checker.name, 'pull', elapsed)
+        for cur_res, message, elapsed in results:
+            logger.info('[%d]  %s: status=%s, message="%s"', round_number, checker.name, cur_res, message)
+            stats.record(team_ip, checker.name, 'pull', cur_res, message, round_number, elapsed)
+
+    async def push_pull(round_number, checker, n_pulls):
+        await push(round_number, checker)
+        pool_flag_labels = pools[checker.name]
+        first = max(len(pool_flag_labels) - n_pulls, 0)
+        if checker.pull_many is not None and not PULL_SEPARATELY:
+            await pull_many(round_number, checker,
+                            [(i, pool_flag_labels[i]) for i in range(first, len(pool_flag_labels))])
+            return
+        pulls = [pull(round_number, checker, i, pool_flag_labels[i]) for i in range(first, len(pool_flag_labels))]
+        if SCHEDULE_CONCURRENT:
+            await asyncio.gather(*pulls)
+        else:
+            for coro in pulls:
+                await coro
+
+    async def push_pull_sequentially(round_number, n_pulls):
+        for checker in checkers:
+            await push_pull(round_number, checker, n_pulls)
 
     # 3. start the simulation
     round_number = 0
-    while True:
+    while not shutdown.requested:
         round_number += 1
         logger.info('Round %d', round_number)
 
-        for service_name, push_fn, pull_fn, pool_flag_labels, latest, push_stats, pull_stats in services:
-            logger.info('[%d]  Push-pulling service %s', round_number, service_name)
-
-            md = Metadata(round_number)
-            label = hashlib.md5(uuid.uuid4().bytes).hexdigest()[:16]
-            cur_flag = gen_capsule()
-
-            logger.info('[%d]  Pushing flag %s', round_number, cur_flag)
-            cur_res, label, message = await push_fn(team_ip, cur_flag, label, md)
-            logger.info('[%d]  Status=%s, message="%s"', round_number, cur_res, message)
-            push_stats[cur_res] += 1
-            latest['push']['status'] = cur_res.name
-            latest['push']['message'] = message
-            if cur_res == Result.UP:
-                add_flag_to_pool(pool_flag_labels, cur_flag, label, pull_count=PULL_COUNT)
-
-            for i in range(len(pool_flag_labels)):
-                cur_flag = pool_flag_labels[i]['flag']
-                label = pool_flag_labels[i]['label']
-                logger.info('[%d]  Pulling flag %s', round_number, cur_flag)
-                cur_res, message = await pull_fn(team_ip, cur_flag, label, md)
-                logger.info('[%d]  Status=%s, message="%s"', round_number, cur_res, message)
-                pull_stats[cur_res] += 1
-                latest['pull']['status'] = cur_res.name
-                latest['pull']['message'] = message
-            logger.info('')
+        # N.B. warn if the round is projected to overrun and (optionally) PULL only the latest flags
+        n_pulls = PULL_COUNT
+        projected = capacity.predict_round(service_names, PULL_COUNT)
+        if projected > ROUND_DURATION:
+            if CAPACITY_AUTO_THROTTLE:
+                n_pulls = capacity.max_pulls(service_names, PULL_COUNT, ROUND_DURATION)
+            logger.warning('[%d]  Projected round time %.1fs exceeds round duration %ss for %d team(s), '
+                           'PULLs per service: %d', round_number, projected, ROUND_DURATION, CAPACITY_TEAMS, n_pulls)
+
+        # N.B. services are push-pulled one after another, or concurrently if SCHEDULE_CONCURRENT (CPU-heavy ones
+        #      are started first)
+        if SCHEDULE_CONCURRENT:
+            await shutdown.run(asyncio.gather(*(push_pull(round_number, checker, n_pulls) for checker in checkers)))
+        else:
+            await shutdown.run(push_pull_sequentially(round_number, n_pulls))
+        logger.info('')
 
         if PRINT_STATS_EVERY_N_ROUND > 0 and round_number % PRINT_STATS_EVERY_N_ROUND == 0:
-            print_stats(services)
-
-        await asyncio.sleep(timeout)
+            print_stats(stats, capacity, watchdog)
+        if profiler is not None and round_number % PROFILER_EVERY_N_ROUND == 0:
+            profiler.dump(profiled_from, round_number)
+            profiled_from = round_number + 1
+
+        await shutdown.sleep(timeout)
+
+    # 4. flush the stats and the trace, close the checkers' sessions and connections
+    if PRINT_STATS_EVERY_N_ROUND > 0 and round_number % PRINT_STATS_EVERY_N_ROUND != 0:
+        print_stats(stats, capacity, watchdog)
+    if watchdog is not None:
+        watchdog.stop()
+    if profiler is not None:
+        profiler.stop()
+        if profiled_from <= round_number:
+            profiler.dump(profiled_from, round_number)
+    await close_checkers(checkers)
+    recorder.close()
+    executors.shutdown(wait=False)
+    logger.info('Stopped after %d round(s)', round_number)
 
 
 # endregion Themis imitator
@@ -201,4 +316,5 @@ if __name__ == '__main__':
     # start the checker
     loop = asyncio.get_event_loop()
     loop.run_until_complete(main(TEAM_IP, ROUND_DURATION))
+    loop.run_until_complete(loop.shutdown_asyncgens())
     loop.close()
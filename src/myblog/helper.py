@@ -8,9 +8,9 @@ def get_rand_element(collection):
     return collection[num]
 
 
-def random_str(length=10):
+def random_str(length=10, rng=random):
     letters = string.ascii_lowercase
-    return ''.join(random.choice(letters) for i in range(length))
+    return ''.join(rng.choice(letters) for i in range(length))
 
 def make_creds():
     username = f'{{{random_str(15)}}}'
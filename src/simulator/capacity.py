@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import math
+
+
+class CapacityModel(object):
+    # Rolling (exponentially weighted) model of PUSH/PULL cost per service, used to predict the wall time
+    #   of a round for `n_teams` checked with `concurrency` checks running at once
+    def __init__(self, n_teams=1, concurrency=1, alpha=0.2):
+        self.n_teams = n_teams
+        self.concurrency = max(concurrency, 1)
+        self.alpha = alpha
+        self._costs = {}
+
+    def observe(self, service_name, operation, elapsed):
+        key = (service_name, operation)
+        cost = self._costs.get(key)
+        self._costs[key] = elapsed if cost is None else cost + self.alpha * (elapsed - cost)
+
+    def cost(self, service_name, operation):
+        return self._costs.get((service_name, operation))
+
+    def service_cost(self, service_name, n_pulls):
+        return (self.cost(service_name, 'push') or 0.0) + n_pulls * (self.cost(service_name, 'pull') or 0.0)
+
+    def predict_round(self, service_names, n_pulls):
+        # N.B. the checks of all the teams are spread evenly over `concurrency` workers
+        total = sum(self.service_cost(service_name, n_pulls) for service_name in service_names)
+        return total * self.n_teams / self.concurrency
+
+    def max_pulls(self, service_names, n_pulls, round_duration):
+        # N.B. the number of PULLs per service (not more than `n_pulls`, at least 1) for the round to fit
+        push_total = sum(self.cost(service_name, 'push') or 0.0 for service_name in service_names)
+        pull_total = sum(self.cost(service_name, 'pull') or 0.0 for service_name in service_names)
+        if pull_total == 0:
+            return n_pulls
+        budget = round_duration * self.concurrency / self.n_teams - push_total
+        return max(1, min(n_pulls, int(math.floor(budget / pull_total))))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import signal
+
+logger = logging.getLogger(__name__)
+
+# N.B. time given to the cancelled checks to unwind (close their sessions and sockets) before they are abandoned
+CANCEL_GRACE = 1.0
+# N.B. time given to a checker's shutdown hook
+CLOSE_TIMEOUT = 5.0
+
+
+class Shutdown(object):
+    # Stops the simulation on SIGINT/SIGTERM: no new checks are started (see `requested`), the checks in flight
+    #   are given `deadline` seconds to finish, the stragglers are cancelled then. A second signal cancels the
+    #   checks in flight right away.
+    #   N.B. on Python 3.7 CancelledError is an Exception, so a cancelled checker may still return a result
+    #        (usually DOWN or MUMBLE), such results must be dropped once `cancelled` is set
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.requested = False
+        self.cancelled = False
+        self._requested = asyncio.Event()
+        self._forced = asyncio.Event()
+
+    def install(self, loop=None):
+        loop = loop or asyncio.get_event_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.request, signum)
+
+    def request(self, signum=None):
+        name = signal.Signals(signum).name if signum is not None else 'request'
+        if self.requested:
+            logger.warning('%s received again, cancelling the checks in flight', name)
+            self._forced.set()
+            return
+        logger.warning('%s received, finishing the checks in flight (deadline %ss)', name, self.deadline)
+        self.requested = True
+        self._requested.set()
+
+    async def sleep(self, timeout):
+        # N.B. returns early if shutdown is requested
+        try:
+            await asyncio.wait_for(self._requested.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self, coro):
+        # Runs the checks of a round, draining them within the deadline if shutdown is requested meanwhile
+        task = asyncio.ensure_future(coro)
+        waiter = asyncio.ensure_future(self._requested.wait())
+        await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+
+        if not task.done():
+            forced = asyncio.ensure_future(self._forced.wait())
+            await asyncio.wait({task, forced}, timeout=self.deadline, return_when=asyncio.FIRST_COMPLETED)
+            forced.cancel()
+            if not task.done():
+                logger.warning('Cancelling the checks in flight')
+                self.cancelled = True
+                task.cancel()
+                await asyncio.wait({task}, timeout=CANCEL_GRACE)
+                if not task.done():
+                    logger.warning('Checks in flight did not stop within %ss, abandoning them', CANCEL_GRACE)
+                elif not task.cancelled():
+                    # N.B. a cancelled gather finishes with CancelledError set, retrieve it to keep asyncio quiet
+                    task.exception()
+                return
+            logger.info('Checks in flight finished')
+
+        if not task.cancelled():
+            task.result()
+
+
+async def close_checkers(checkers):
+    # Runs the checkers' shutdown hooks (closing their cached sessions and connections)
+    for checker in checkers:
+        if checker.shutdown is None:
+            continue
+        try:
+            await asyncio.wait_for(checker.shutdown(), CLOSE_TIMEOUT)
+        except Exception as ex:
+            logger.error('Failed to shut down %s: %r', checker.name, ex)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+from common.executors import running_checks
+
+logger = logging.getLogger(__name__)
+
+STACK_DEPTH = 64
+UNKNOWN = '?'
+# N.B. packages of the event loop and the thread pools: their frames above the checks are dropped
+BOILERPLATE = ('asyncio', 'concurrent', 'threading', 'selectors')
+# N.B. packages whose functions are steps themselves, the rest are the libraries the steps call into
+OWN_PACKAGES = ('__main__', 'main', 'common', 'simulator')
+SIMULATOR_MODULES = ('__main__', 'main')
+# N.B. the simulator's functions running a check, by operation
+CHECK_FUNCTIONS = {'push': 'push', 'pull': 'pull', 'pull_many': 'pull'}
+TOP_STEPS = 10
+
+
+def thread_cpu_time(ident):
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+
+def walk(frame, depth=STACK_DEPTH):
+    # (module, function) of the frames below the event loop (or the thread pool), outermost first,
+    #   and the (service, operation) found in the simulator's push/pull frame
+    stack, check = [], None
+    while frame is not None and len(stack) < depth:
+        module, function = frame.f_globals.get('__name__', UNKNOWN), frame.f_code.co_name
+        if check is None and module in SIMULATOR_MODULES and function in CHECK_FUNCTIONS:
+            checker = frame.f_locals.get('checker')
+            if checker is not None:
+                check = (checker.name, CHECK_FUNCTIONS[function])
+        stack.append((module, function))
+        frame = frame.f_back
+    stack.reverse()
+    start = 0
+    while start < len(stack) - 1:
+        module, function = stack[start]
+        if module.split('.', 1)[0] not in BOILERPLATE and function != '<module>':
+            break
+        start += 1
+    return stack[start:], check
+
+
+def attribute(stack, check, service_names):
+    # service, operation and step: the innermost checker/simulator function and the library function it calls
+    #   into, e.g. `embed_lsb`, `gen_capsule`, `push_operation>jwt.encode`, `get_random_user_agent>faker.__init__`
+    service, operation = check if check is not None else (None, None)
+    owner, entry = None, None
+    for module, function in stack:
+        package = module.split('.', 1)[0]
+        if package in service_names:
+            service = service or package
+        if package in service_names or package in OWN_PACKAGES:
+            owner, entry = function, None
+            if operation is None and ('push' in function or 'pull' in function):
+                operation = 'push' if 'push' in function else 'pull'
+        elif owner is not None and entry is None and package not in BOILERPLATE:
+            entry = '{0}.{1}'.format(package, function)
+    if owner is None:
+        step = '{0}.{1}'.format(stack[-1][0].split('.', 1)[0], stack[-1][1]) if stack else UNKNOWN
+    else:
+        step = owner if entry is None else '{0}>{1}'.format(owner, entry)
+    return service or UNKNOWN, operation or UNKNOWN, step
+
+
+class SamplingProfiler(object):
+    # Samples the stacks of the simulator's threads (the event loop and the thread pool) every `interval` seconds,
+    #   weighing a sample by the CPU time its thread consumed since the previous sample, so that threads waiting
+    #   on sockets or in select() don't count. The samples are attributed to (service, operation, step) and
+    #   written as collapsed stacks (`service;operation;frame;...;frame <CPU microseconds>`, for flamegraph.pl
+    #   and speedscope).
+    #   N.B. the process pool's work isn't sampled, EXECUTOR_OVERRIDE=thread brings it into the process
+    #   N.B. the sampler's own CPU time is measured, the interval is doubled while it exceeds `max_overhead`
+    #        of the wall time
+    def __init__(self, path, service_names, interval, max_overhead):
+        self.path = path
+        self.service_names = frozenset(service_names)
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.stacks = collections.Counter()
+        self.steps = collections.Counter()
+        self.n_samples = 0
+        self._cpu = {}
+        self._overhead = 0.0
+        self._window_started = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._window_started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        adapted = time.monotonic()
+        while not self._stopped.wait(self.interval):
+            started = time.thread_time()
+            self._sample(own)
+            with self._lock:
+                self._overhead += time.thread_time() - started
+                overhead = self._overhead / max(time.monotonic() - self._window_started, 1e-9)
+            if overhead > self.max_overhead and time.monotonic() - adapted > 1:
+                adapted = time.monotonic()
+                self.interval *= 2
+                logger.info('Profiler overhead %.1f%% exceeds %.1f%%, sampling every %.0fms', 100 * overhead,
+                            100 * self.max_overhead, 1000 * self.interval)
+
+    def _sample(self, own):
+        frames = sys._current_frames()
+        for ident in list(self._cpu):
+            if ident not in frames:
+                del self._cpu[ident]
+        for ident, frame in frames.items():
+            if ident == own:
+                continue
+            cpu = thread_cpu_time(ident)
+            if cpu is None:
+                weight = self.interval
+            else:
+                previous, self._cpu[ident] = self._cpu.get(ident), cpu
+                if previous is None or cpu <= previous:
+                    continue
+                weight = cpu - previous
+            stack, check = walk(frame)
+            service, operation, step = attribute(stack, check or running_checks.get(ident), self.service_names)
+            collapsed = ';'.join([service, operation] + ['{0}.{1}'.format(*f) for f in stack])
+            with self._lock:
+                self.stacks[collapsed] += weight
+                self.steps[(service, operation, step)] += weight
+                self.n_samples += 1
+        del frames
+
+    def dump(self, first_round, last_round):
+        with self._lock:
+            stacks, self.stacks = self.stacks, collections.Counter()
+            steps, self.steps = self.steps, collections.Counter()
+            n_samples, self.n_samples = self.n_samples, 0
+            overhead, self._overhead = self._overhead, 0.0
+            now = time.monotonic()
+            elapsed, self._window_started = now - self._window_started, now
+
+        file_path = os.path.join(self.path, 'rounds-{0:05d}-{1:05d}.collapsed'.format(first_round, last_round))
+        with open(file_path, 'w') as f:
+            for collapsed, weight in stacks.most_common():
+                f.write('{0} {1}\n'.format(collapsed, int(round(weight * 1e6))))
+
+        logger.info('Profile of rounds %d-%d written to %s: %d samples, %.3fs CPU sampled, overhead %.2f%% '
+                    '(%.3fs of %.1fs, sampling every %.0fms)', first_round, last_round, file_path, n_samples,
+                    sum(steps.values()), 100 * overhead / max(elapsed, 1e-9), overhead, elapsed,
+                    1000 * self.interval)
+        for (service, operation, step), weight in steps.most_common(TOP_STEPS):
+            logger.info('  %-10s %-4s %-50s %.3fs', service, operation.upper(), step, weight)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import importlib
+import os
+import sys
+
+from common.executors import EXECUTOR_LOOP, EXECUTOR_PROCESS, EXECUTOR_PROCESSES, EXECUTOR_THREAD, EXECUTORS, \
+    assign_executor
+
+OPERATIONS = ('push', 'pull')
+
+# N.B. if set, overrides the executor declared by every checker: `loop` runs everything inline, `thread` keeps
+#      the event loop free without worker processes (sockets can't be passed to a process, so no `process`)
+EXECUTOR_OVERRIDE = os.getenv('EXECUTOR_OVERRIDE')
+
+# N.B. hints assumed for a checker module without PROFILE: an I/O-bound operation run one at a time
+DEFAULT_PROFILE = {
+    'cpu_heavy': False,
+    'io_bound': True,
+    'max_concurrency': 1,
+    'executor': EXECUTOR_LOOP,
+}
+
+
+class Profile(object):
+    # Resource profile of a checker's operation, declared in the checker module as
+    #   PROFILE = {'push': {...}, 'pull': {...}} with the keys of DEFAULT_PROFILE
+    __slots__ = ('cpu_heavy', 'io_bound', 'max_concurrency', 'executor')
+
+    def __init__(self, cpu_heavy, io_bound, max_concurrency, executor):
+        if executor not in EXECUTORS:
+            raise ValueError('Unknown executor: {0}'.format(executor))
+        if max_concurrency < 1:
+            raise ValueError('Incorrect max_concurrency: {0}'.format(max_concurrency))
+        self.cpu_heavy = cpu_heavy
+        self.io_bound = io_bound
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+
+    def describe(self):
+        return '{0}{1}/{2} x{3}'.format(
+            'cpu' if self.cpu_heavy else '',
+            '+io' if self.cpu_heavy and self.io_bound else ('io' if self.io_bound else ''),
+            self.executor, self.max_concurrency)
+
+
+class Checker(object):
+    __slots__ = ('name', 'module', 'push', 'pull', 'pull_many', 'shutdown', 'profiles')
+
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+        self.push = module.push
+        self.pull = module.pull
+        # N.B. optional `async def pull_many(endpoint, [(capsule, label, metadata), ...], concurrency)` returning
+        #      (result, message, elapsed) of every PULL in order (see common/batches.py), running at most `concurrency`
+        #      of them at once and sharing logins, connections and listings across the batch
+        self.pull_many = getattr(module, 'pull_many', None)
+        # N.B. optional `async def shutdown()` closing the checker's cached sessions and connections
+        self.shutdown = getattr(module, 'shutdown', None)
+        declared = getattr(module, 'PROFILE', {})
+        self.profiles = {}
+        for operation in OPERATIONS:
+            hints = dict(DEFAULT_PROFILE, **declared.get(operation, {}))
+            if EXECUTOR_OVERRIDE is not None:
+                hints['executor'] = EXECUTOR_OVERRIDE
+            # N.B. a CPU-bound operation can't run faster than the process pool allows
+            if hints['cpu_heavy'] and hints['executor'] == EXECUTOR_PROCESS:
+                hints['max_concurrency'] = min(hints['max_concurrency'], EXECUTOR_PROCESSES)
+            self.profiles[operation] = Profile(**hints)
+            # N.B. the checker looks the (possibly overridden) executor up at call time, see executor_for
+            assign_executor(module.__name__, operation, hints['executor'])
+
+    @property
+    def cpu_heavy(self):
+        return any(profile.cpu_heavy for profile in self.profiles.values())
+
+    def describe(self):
+        return '{0} (PUSH {1}, PULL {2}{3})'.format(
+            self.name, self.profiles['push'].describe(), self.profiles['pull'].describe(),
+            ' batched' if self.pull_many is not None else '')
+
+
+def load_checkers(services):
+    # services: (name, module name, skip); modules of the skipped services are not imported at all.
+    #   CPU-heavy checkers go first, so that their work overlaps with the I/O of the rest
+    if EXECUTOR_OVERRIDE not in (None, EXECUTOR_LOOP, EXECUTOR_THREAD):
+        raise ValueError('Incorrect EXECUTOR_OVERRIDE: {0}'.format(EXECUTOR_OVERRIDE))
+    checkers = []
+    for service_name, module_name, skip in services:
+        if skip:
+            continue
+        checkers.append(Checker(service_name, importlib.import_module(module_name)))
+    checkers.sort(key=lambda checker: not checker.cpu_heavy)
+    # N.B. the shared fake profiles are generated now rather than inside the first check (blocking the loop),
+    #      if any of the loaded checkers uses them
+    pool_module = sys.modules.get('common.profiles')
+    if pool_module is not None and not pool_module.profiles.built:
+        pool_module.profiles.build()
+    return checkers
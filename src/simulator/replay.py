@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# Replays the traffic recorded by the checkers (TRACE_PATH, see common/trace.py) against a target, so that
+#   a vulnbox can be loaded without the checkers' own CPU cost (image generation, crypto, etc.)
+#
+# Usage (from the `src` folder):
+#   $ python -m simulator.replay TRACE_PATH TARGET_IP [--speed-up 10] [--concurrency 64] [--services editor,myblog]
+#
+# Flows (client sessions and sockets) are started at their recorded offsets divided by the speed-up factor,
+#   requests within a flow are issued in order and not earlier than their scaled offsets. Bodies larger than
+#   TRACE_MAX_PAYLOAD were not recorded, zeros of the recorded size are sent instead.
+import argparse
+import asyncio
+import collections
+import statistics
+import struct
+import time
+
+import aiohttp
+
+from common.trace import ENDPOINT, RECORD_HTTP, read_trace, unpack_headers
+
+FRAME_LENGTH = struct.Struct('<Q')
+
+
+def load_flows(path, services=None):
+    flows = collections.OrderedDict()
+    for record in sorted(read_trace(path), key=lambda r: r.started):
+        if services is not None and record.service not in services:
+            continue
+        flows.setdefault((record.kind, record.flow), []).append(record)
+    return list(flows.values())
+
+
+def body_of(record):
+    if record.payload or record.sent == 0:
+        return record.payload
+    return bytes(record.sent)
+
+
+class Replay(object):
+    def __init__(self, flows, target, speed_up, concurrency, timeout):
+        self.flows = flows
+        self.target = target
+        self.speed_up = speed_up
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.timeout = timeout
+        self.trace_started = min(flow[0].started for flow in flows)
+        self.started = None
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.sent = collections.Counter()
+        self.received = collections.Counter()
+
+    async def wait_for(self, record):
+        delay = (record.started - self.trace_started) / self.speed_up - (time.monotonic() - self.started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def replay_http(self, flow):
+        async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True),
+                                         timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+            for record in flow:
+                await self.wait_for(record)
+                headers = unpack_headers(record.headers)
+                # N.B. the recorded cookies are only needed if the flow had them set without a cookie jar
+                if len(session.cookie_jar):
+                    headers.pop('Cookie', None)
+                body = body_of(record)
+                started = time.monotonic()
+                try:
+                    async with session.request(record.method, record.target.replace(ENDPOINT, self.target),
+                                               data=body or None, headers=headers) as r:
+                        self.received[record.service] += len(await r.read())
+                    self.latencies[record.service].append(time.monotonic() - started)
+                except Exception:
+                    self.errors[record.service] += 1
+                self.sent[record.service] += len(body)
+
+    async def replay_frames(self, flow):
+        host, port = flow[0].target.replace(ENDPOINT, self.target).rsplit(':', 1)
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port)), self.timeout)
+        try:
+            for record in flow:
+                await self.wait_for(record)
+                started = time.monotonic()
+                if record.method == 'SEND':
+                    body = body_of(record)
+                    writer.write(FRAME_LENGTH.pack(len(body)) + body)
+                    await writer.drain()
+                    self.sent[record.service] += len(body)
+                else:
+                    length, = FRAME_LENGTH.unpack(await asyncio.wait_for(reader.readexactly(8), self.timeout))
+                    await asyncio.wait_for(reader.readexactly(length), self.timeout)
+                    self.received[record.service] += length
+                self.latencies[record.service].append(time.monotonic() - started)
+        finally:
+            writer.close()
+
+    async def replay_flow(self, flow):
+        await self.wait_for(flow[0])
+        async with self.semaphore:
+            try:
+                if flow[0].kind == RECORD_HTTP:
+                    await self.replay_http(flow)
+                else:
+                    await self.replay_frames(flow)
+            except Exception:
+                self.errors[flow[0].service] += 1
+
+    async def run(self):
+        self.started = time.monotonic()
+        await asyncio.gather(*(self.replay_flow(flow) for flow in self.flows))
+        return time.monotonic() - self.started
+
+    def print_summary(self, elapsed):
+        print('{0:<10} {1:>8} {2:>8} {3:>10} {4:>10} {5:>12} {6:>12}'.format(
+            'service', 'requests', 'errors', 'p50', 'p95', 'sent', 'received'))
+        for service in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies[service])
+            p50 = statistics.median(latencies) if latencies else 0
+            p95 = latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0
+            print('{0:<10} {1:>8} {2:>8} {3:>9.3f}s {4:>9.3f}s {5:>12} {6:>12}'.format(
+                service, len(latencies), self.errors[service], p50, p95, self.sent[service],
+                self.received[service]))
+        trace_duration = max(r.started + r.duration for flow in self.flows for r in flow) - self.trace_started
+        print('Replayed {0:.1f}s of traffic in {1:.1f}s (x{2:.1f})'.format(
+            trace_duration, elapsed, trace_duration / elapsed if elapsed else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a checkers\' trace against a target')
+    parser.add_argument('trace', help='trace file recorded with TRACE_PATH')
+    parser.add_argument('target', help='address of the target (replaces the recorded team\'s address)')
+    parser.add_argument('--speed-up', type=float, default=1.0, help='time compression factor')
+    parser.add_argument('--concurrency', type=int, default=64, help='maximum number of flows replayed at once')
+    parser.add_argument('--services', help='comma separated services to replay (all by default)')
+    parser.add_argument('--timeout', type=float, default=30, help='timeout of a request, seconds')
+    args = parser.parse_args()
+
+    flows = load_flows(args.trace, set(args.services.split(',')) if args.services else None)
+    if not flows:
+        print('Nothing to replay')
+        return
+    loop = asyncio.get_event_loop()
+    replay = Replay(flows, args.target, args.speed_up, args.concurrency, args.timeout)
+    elapsed = loop.run_until_complete(replay.run())
+    replay.print_summary(elapsed)
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
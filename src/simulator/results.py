@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from array import array
+
+# N.B. numpy is imported on the first aggregation, not at startup (only editor needs it otherwise);
+#      without it the aggregation falls back to plain loops
+_numpy = None
+
+
+def get_numpy():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+class Check(object):
+    # A recorded check, read from a ResultStore
+    __slots__ = ('round_number', 'row', 'result', 'elapsed', 'step')
+
+    def __init__(self, round_number, row, result, elapsed, step):
+        self.round_number = round_number
+        self.row = row
+        self.result = result
+        self.elapsed = elapsed
+        self.step = step
+
+    def __repr__(self):
+        return 'Check(round={0}, row={1}, result={2}, elapsed={3:.3f}, step={4!r})'.format(
+            self.round_number, self.row, self.result, self.elapsed, self.step)
+
+
+class ResultStore(object):
+    # Every recorded check, kept in columns (arrays), 14 bytes per check:
+    #   `rounds` - the round number, `codes` - row * n_results + result index (the row identifies the team,
+    #   service and operation, see Stats), `elapsed` - the check's time (sec), `steps` - the failed step,
+    #   the check's message interned into `messages` (0 - the check succeeded)
+    #   N.B. a batched PULL records its own time plus its share of the batch's common steps
+    def __init__(self, n_results):
+        self.n_results = n_results
+        self.rounds = array('I')
+        self.codes = array('I')
+        self.elapsed = array('f')
+        self.steps = array('H')
+        self.messages = ['']
+        self._message_codes = {'': 0}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        row, result = divmod(self.codes[i], self.n_results)
+        return Check(self.rounds[i], row, result, self.elapsed[i], self.messages[self.steps[i]])
+
+    def intern(self, message):
+        code = self._message_codes.get(message)
+        if code is None:
+            # N.B. the messages are the checkers' fixed step descriptions, the last code is shared on overflow
+            code = min(len(self.messages), 0xFFFF)
+            if code == len(self.messages):
+                self.messages.append(message)
+                self._message_codes[message] = code
+        return code
+
+    def append(self, round_number, row, result, elapsed, message):
+        # result: the result index, message: the failed step ('' if the check succeeded)
+        self.rounds.append(round_number)
+        self.codes.append(row * self.n_results + result)
+        self.elapsed.append(elapsed)
+        self.steps.append(self.intern(message) if message else 0)
+
+    def aggregate(self, start, counters, elapsed_sums, failures):
+        # Adds the checks recorded since `start` to the counters (a slot per code), the elapsed time sums (a slot
+        #   per row) and the failed steps counts ({(row, step): count}), returns the new start
+        end = len(self)
+        if start >= end:
+            return start
+        numpy = get_numpy()
+        if numpy is None:
+            codes, elapsed, steps = self.codes, self.elapsed, self.steps
+            for i in range(start, end):
+                code = codes[i]
+                row = code // self.n_results
+                counters[code] += 1
+                elapsed_sums[row] += elapsed[i]
+                if steps[i]:
+                    failures[(row, steps[i])] = failures.get((row, steps[i]), 0) + 1
+            return end
+
+        # N.B. the views are dropped before returning, the arrays can't grow while exported
+        codes = numpy.frombuffer(self.codes, dtype=numpy.uint32)[start:end]
+        rows = codes // self.n_results
+        counts = numpy.frombuffer(counters, dtype=numpy.uint64)
+        counts += numpy.bincount(codes, minlength=len(counters)).astype(numpy.uint64)
+        sums = numpy.frombuffer(elapsed_sums, dtype=numpy.float64)
+        sums += numpy.bincount(rows, weights=numpy.frombuffer(self.elapsed, dtype=numpy.float32)[start:end],
+                               minlength=len(elapsed_sums))
+        steps = numpy.frombuffer(self.steps, dtype=numpy.uint16)[start:end]
+        failed = numpy.flatnonzero(steps)
+        for row, step in zip(rows[failed].tolist(), steps[failed].tolist()):
+            failures[(row, step)] = failures.get((row, step), 0) + 1
+        del codes, rows, counts, sums, steps, failed
+        return end
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import json
+from array import array
+
+from volgactf.final.checker.result import Result
+
+from simulator.results import ResultStore
+
+OPERATIONS = ('push', 'pull')
+RESULTS = tuple(Result)
+RESULT_INDEX = {r: i for i, r in enumerate(RESULTS)}
+# N.B. results shown in the text blocks, TOTAL also counts the rest (INTERNAL_ERROR)
+SHOWN_RESULTS = (Result.UP, Result.MUMBLE, Result.CORRUPT, Result.DOWN)
+
+BLOCK_TEMPLATE = '''\
+  Service      **{name}**{team}
+  Latest PUSH
+    status:    {push_status}
+    message:   {push_message}
+  Latest PULL
+    status:    {pull_status}
+    message:   {pull_message}
+
+  Statistics (PUSH){padding}    Statistics (PULL)
+    UP:      {push_up: <{n}}      UP:      {pull_up: <{n}}
+    MUMBLE:  {push_mumble: <{n}}      MUMBLE:  {pull_mumble: <{n}}
+    CORRUPT: {push_corrupt: <{n}}      CORRUPT: {pull_corrupt: <{n}}
+    DOWN:    {push_down: <{n}}      DOWN:    {pull_down: <{n}}
+    TOTAL:   {push_total: <{n}}      TOTAL:   {pull_total: <{n}}\
+'''
+
+
+class Stats(object):
+    # Result counters of every (team, service, operation) row, aggregated from the recorded checks (see
+    #   simulator/results.py) into flat arrays before an output: `counters` - one slot per result,
+    #   `elapsed_sums` - one slot per row, `failures` - {(row, failed step): count}.
+    #   Text blocks are cached and rendered again only for the rows updated since the previous output
+    def __init__(self, teams, service_names):
+        self.teams = list(teams)
+        self.service_names = list(service_names)
+        self._team_index = {team: i for i, team in enumerate(self.teams)}
+        self._service_index = {service_name: i for i, service_name in enumerate(self.service_names)}
+        n_rows = len(self.teams) * len(self.service_names) * len(OPERATIONS)
+        self.checks = ResultStore(len(RESULTS))
+        self.counters = array('Q', bytes(8 * n_rows * len(RESULTS)))
+        self.elapsed_sums = array('d', bytes(8 * n_rows))
+        self.failures = {}
+        self.latest = [['', ''] for _ in range(n_rows)]
+        self._aggregated = 0
+        self._blocks = [None] * (len(self.teams) * len(self.service_names))
+        self._widths = [0] * len(self._blocks)
+        self._dirty = set(range(len(self._blocks)))
+
+    def _row(self, team, service_name, operation):
+        block = self._team_index[team] * len(self.service_names) + self._service_index[service_name]
+        return block, block * len(OPERATIONS) + (0 if operation == 'push' else 1)
+
+    def record(self, team, service_name, operation, result, message, round_number=0, elapsed=0.0):
+        block, row = self._row(team, service_name, operation)
+        self.checks.append(round_number, row, RESULT_INDEX[result], elapsed, '' if result == Result.UP else message)
+        latest = self.latest[row]
+        latest[0] = result.name
+        latest[1] = message
+        self._dirty.add(block)
+
+    def aggregate(self):
+        self._aggregated = self.checks.aggregate(self._aggregated, self.counters, self.elapsed_sums, self.failures)
+
+    def count(self, team, service_name, operation, result):
+        self.aggregate()
+        _, row = self._row(team, service_name, operation)
+        return self.counters[row * len(RESULTS) + RESULT_INDEX[result]]
+
+    def total(self, team, service_name, operation):
+        self.aggregate()
+        _, row = self._row(team, service_name, operation)
+        return self.row_total(row)
+
+    def row_total(self, row):
+        return sum(self.counters[row * len(RESULTS):(row + 1) * len(RESULTS)])
+
+    def mean_elapsed(self, row):
+        return self.elapsed_sums[row] / max(self.row_total(row), 1)
+
+    def row_failures(self, row):
+        # {failed step: count}, most frequent first
+        failures = [(self.checks.messages[step], c) for (r, step), c in self.failures.items() if r == row]
+        return dict(sorted(failures, key=lambda f: -f[1]))
+
+    def rows(self):
+        # (team, service, operation, row) for every counter row
+        row = 0
+        for team in self.teams:
+            for service_name in self.service_names:
+                for operation in OPERATIONS:
+                    yield team, service_name, operation, row
+                    row += 1
+
+    # region Output
+
+    def render_block(self, block):
+        team = self.teams[block // len(self.service_names)]
+        service_name = self.service_names[block % len(self.service_names)]
+        push_row, pull_row = block * 2, block * 2 + 1
+        push_counts = self.counters[push_row * len(RESULTS):(push_row + 1) * len(RESULTS)]
+        pull_counts = self.counters[pull_row * len(RESULTS):(pull_row + 1) * len(RESULTS)]
+        # N.B. totals are the largest numbers in the block
+        push_total, pull_total = self.row_total(push_row), self.row_total(pull_row)
+        n = max(6, len(str(push_total)), len(str(pull_total)))
+        values = {}
+        for r in SHOWN_RESULTS:
+            values['push_' + r.name.lower()] = push_counts[RESULT_INDEX[r]]
+            values['pull_' + r.name.lower()] = pull_counts[RESULT_INDEX[r]]
+        return BLOCK_TEMPLATE.format(
+            name=service_name,
+            team='' if len(self.teams) < 2 else ' @ {0}'.format(team),
+            push_status=self.latest[push_row][0],
+            push_message=self.latest[push_row][1],
+            pull_status=self.latest[pull_row][0],
+            pull_message=self.latest[pull_row][1],
+            padding=' ' * (n - 6),
+            push_total=push_total,
+            pull_total=pull_total,
+            n=n,
+            **values
+        ).split('\n')
+
+    def format_text(self, single_column=False):
+        self.aggregate()
+        for block in self._dirty:
+            self._blocks[block] = self.render_block(block)
+            self._widths[block] = max(len(line) for line in self._blocks[block])
+        self._dirty = set()
+
+        max_width = max(self._widths)
+        border = '=' * max_width
+        out = []
+        if single_column or len(self._blocks) < 2:
+            for lines in self._blocks:
+                out.append(border)
+                out.extend(lines)
+                out.append(border)
+        else:
+            width = max_width + 4
+            double_border = border.ljust(width) * 2
+            for left, right in zip(self._blocks[0::2], self._blocks[1::2]):
+                out.append(double_border)
+                out.extend(ll.ljust(width) + rl.ljust(width) for ll, rl in zip(left, right))
+                out.append(double_border)
+            if len(self._blocks) & 1:
+                out.append(border)
+                out.extend(self._blocks[-1])
+                out.append(border)
+        return '\n'.join(out)
+
+    def format_csv(self):
+        self.aggregate()
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator='\n')
+        writer.writerow(['team', 'service', 'operation'] + [r.name for r in RESULTS] + ['TOTAL', 'MEAN_ELAPSED'])
+        for team, service_name, operation, row in self.rows():
+            counts = self.counters[row * len(RESULTS):(row + 1) * len(RESULTS)]
+            writer.writerow([team, service_name, operation] + counts.tolist() +
+                            [self.row_total(row), '{0:.3f}'.format(self.mean_elapsed(row))])
+        return buf.getvalue().rstrip('\n')
+
+    def format_json(self):
+        self.aggregate()
+        summary = {}
+        for team, service_name, operation, row in self.rows():
+            counts = self.counters[row * len(RESULTS):(row + 1) * len(RESULTS)]
+            entry = {r.name: c for r, c in zip(RESULTS, counts)}
+            entry['TOTAL'] = self.row_total(row)
+            entry['elapsed'] = round(self.mean_elapsed(row), 3)
+            entry['failures'] = self.row_failures(row)
+            entry['latest'] = {'status': self.latest[row][0], 'message': self.latest[row][1]}
+            summary.setdefault(team, {}).setdefault(service_name, {})[operation] = entry
+        return json.dumps(summary, separators=(',', ':'))
+
+    # endregion Output
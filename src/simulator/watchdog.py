@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+
+from simulator.profiler import CHECK_FUNCTIONS, SIMULATOR_MODULES
+
+logger = logging.getLogger(__name__)
+
+# N.B. the heartbeat and the monitor wake up at half the threshold, but not more often than this
+MIN_INTERVAL = 0.01
+STACK_DEPTH = 32
+# N.B. samples kept per block, the first ones show where the loop got stuck
+MAX_SAMPLES = 16
+UNKNOWN = '?'
+
+
+def extract_stack(frame, depth=STACK_DEPTH):
+    # (module, function, line) of the innermost `depth` frames, outermost first,
+    #   and the (service, operation) found in the simulator's push/pull frame
+    stack, check = [], None
+    while frame is not None and len(stack) < depth:
+        module, function = frame.f_globals.get('__name__', UNKNOWN), frame.f_code.co_name
+        if check is None and module in SIMULATOR_MODULES and function in CHECK_FUNCTIONS:
+            checker = frame.f_locals.get('checker')
+            if checker is not None:
+                check = (checker.name, CHECK_FUNCTIONS[function])
+        stack.append((module, function, frame.f_lineno))
+        frame = frame.f_back
+    stack.reverse()
+    return stack, check
+
+
+def attribute(stack, check, service_names):
+    # service, operation and step (the innermost checker function) of a stack sample
+    #   N.B. if the simulator's frame is beyond the sampled depth, the operation is guessed by the names of the
+    #        checker's functions (`do_push`, `pull_many`...)
+    service, operation = check if check is not None else (None, None)
+    step = None
+    for module, function, _ in stack:
+        package = module.split('.', 1)[0]
+        if package in service_names:
+            service = service or package
+            step = '{0}.{1}'.format(module, function)
+            if operation is None and ('push' in function or 'pull' in function):
+                operation = 'push' if 'push' in function else 'pull'
+    if step is None:
+        step = '{0}.{1}'.format(*stack[-1][:2]) if stack else UNKNOWN
+    return service or UNKNOWN, operation or UNKNOWN, step
+
+
+def collapse(stack):
+    return ';'.join('{0}.{1}:{2}'.format(*frame) for frame in stack)
+
+
+class LoopWatchdog(object):
+    # Detects the event loop being blocked longer than `threshold` seconds:
+    #   a heartbeat coroutine measures the loop lag, a daemon thread samples the loop thread's stack while
+    #   the heartbeat is overdue. Nothing but a timestamp is updated while the loop is responsive.
+    #   Blocks are attributed to (service, operation, step) by the modules of the sampled frames
+    def __init__(self, threshold, service_names):
+        self.threshold = threshold
+        self.interval = max(threshold / 2, MIN_INTERVAL)
+        self.service_names = frozenset(service_names)
+        self.blocks = collections.Counter()
+        self.blocked_time = collections.Counter()
+        self.max_lag = collections.Counter()
+        self._beat = time.monotonic()
+        self._samples = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.ensure_future(self._heartbeat())
+        self._thread = threading.Thread(target=self._monitor, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            self._beat = started
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - started - self.interval
+            with self._lock:
+                samples, self._samples = self._samples, []
+            if lag > self.threshold:
+                self._report(lag, samples)
+
+    def _monitor(self):
+        while not self._stopped.wait(self.interval):
+            if time.monotonic() - self._beat <= self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            sample = extract_stack(frame)
+            del frame
+            with self._lock:
+                if len(self._samples) < MAX_SAMPLES:
+                    self._samples.append(sample)
+
+    def _report(self, lag, samples):
+        if not samples:
+            # N.B. blocked for less than a monitor's interval, no stack to show
+            key = (UNKNOWN, UNKNOWN, UNKNOWN)
+            logger.warning('Event loop blocked for %.3fs (no stack sampled)', lag)
+        else:
+            # N.B. the most frequent step of the block's samples is blamed
+            keys = collections.Counter(attribute(stack, check, self.service_names) for stack, check in samples)
+            key = keys.most_common(1)[0][0]
+            stack = next(stack for stack, check in samples if attribute(stack, check, self.service_names) == key)
+            logger.warning('Event loop blocked for %.3fs by %s %s at %s (%d sample(s))\n    %s',
+                           lag, key[0], key[1].upper(), key[2], len(samples), collapse(stack))
+        self.blocks[key] += 1
+        self.blocked_time[key] += lag
+        self.max_lag[key] = max(self.max_lag[key], lag)
+
+    def format_summary(self):
+        lines = []
+        for key, count in self.blocks.most_common():
+            service, operation, step = key
+            lines.append('  Loop blocked by {0} {1} at {2}: {3}x, {4:.3f}s total, {5:.3f}s max'.format(
+                service, operation.upper(), step, count, self.blocked_time[key], self.max_lag[key]))
+        return '\n'.join(lines)
+
+
+# region Tests
+
+
+def blocking_pull_many_is_blamed_on_pull():
+    # N.B. run as `python -m simulator.watchdog`: this module is `__main__` then, so `push_pull` and `pull_many`
+    #      below stand for the simulator's ones
+    class FakeChecker(object):
+        name = 'fakechk'
+
+    async def pull_many(round_number, checker, flag_labels):
+        time.sleep(0.2)
+
+    async def push_pull(round_number, checker, n_pulls):
+        await pull_many(round_number, checker, [])
+
+    async def run():
+        watchdog = LoopWatchdog(0.05, ['fakechk'])
+        watchdog.start()
+        await asyncio.sleep(0.1)
+        await push_pull(1, FakeChecker(), 1)
+        await asyncio.sleep(0.1)
+        watchdog.stop()
+        return watchdog
+
+    watchdog = asyncio.get_event_loop().run_until_complete(run())
+    assert [(service, operation) for service, operation, _ in watchdog.blocks] == [('fakechk', 'pull')], \
+        watchdog.blocks
+
+
+if __name__ == '__main__':
+    blocking_pull_many_is_blamed_on_pull()
+
+# endregion Tests